@@ -2,21 +2,27 @@ import aiofiles
 import aiohttp
 import asyncio
 import binascii
+import importlib.util
 from packaging.version import parse as parse_version
 import json
 import logging
 import os.path
 import requests
 import struct
+import sys
 import types
 import voluptuous as vol
 
 from aiohttp import ClientSession
 from homeassistant.const import (
     ATTR_FRIENDLY_NAME, __version__ as current_ha_version)
+from homeassistant.core import SupportsResponse
 import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers.storage import STORAGE_DIR
 from homeassistant.helpers.typing import ConfigType
 
+from . import command_table, lazy_json, sidecar, snapshot
+
 _LOGGER = logging.getLogger(__name__)
 
 DOMAIN = 'smartir'
@@ -35,80 +41,329 @@ COMPONENT_ABS_DIR = os.path.dirname(
 CONF_CHECK_UPDATES = 'check_updates'
 CONF_UPDATE_BRANCH = 'update_branch'
 CONF_DEVICE_CODE = 'device_code'
+CONF_PERSISTENT_CONVERSION_CACHE = 'persistent_conversion_cache'
+CONF_PERSISTENT_CONVERSION_CACHE_SIZE = 'persistent_conversion_cache_size'
+CONF_LOOKIN_TIMEOUT = 'lookin_timeout'
+CONF_LOOKIN_MAX_CONCURRENCY = 'lookin_max_concurrency'
+
+SNAPSHOT_SUBDIR = 'snapshots'
+CONVERSION_STORE_FILE = 'conversions.db'
+
+# Entity attributes describing the device file. They never change, so they
+# are left out of the recorder.
+STATIC_ATTRIBUTES = frozenset({
+    'device_code',
+    'manufacturer',
+    'supported_models',
+    'default_controller',
+    'commands_encoding',
+})
 
 CONFIG_SCHEMA = vol.Schema({
     DOMAIN: vol.Schema({
         vol.Optional(CONF_CHECK_UPDATES, default=True): cv.boolean,
         vol.Optional(CONF_UPDATE_BRANCH, default='master'): vol.In(
-            ['master', 'rc'])
+            ['master', 'rc']),
+        vol.Optional(CONF_PERSISTENT_CONVERSION_CACHE, default=False): cv.boolean,
+        vol.Optional(CONF_PERSISTENT_CONVERSION_CACHE_SIZE, default=4096): cv.positive_int,
+        vol.Optional(CONF_LOOKIN_TIMEOUT, default=5): cv.positive_float,
+        vol.Optional(CONF_LOOKIN_MAX_CONCURRENCY, default=2): cv.positive_int
     })
 }, extra=vol.ALLOW_EXTRA)
 
-async def async_get_device_data(platform, config):
-    """Set up an IR platform."""
+# Python device files are registered as modules of this package.
+CODE_MODULES_PACKAGE = 'smartir_codes'
+_CODE_MODULE_MTIMES = {}
+
+# Keys every device file of a platform must provide.
+REQUIRED_DEVICE_KEYS = {
+    'climate': ('manufacturer', 'supportedModels', 'commandsEncoding',
+                'minTemperature', 'maxTemperature', 'precision',
+                'operationModes', 'fanModes'),
+    'fan': ('manufacturer', 'supportedModels', 'commandsEncoding',
+            'speed', 'commands'),
+    'light': ('manufacturer', 'supportedModels', 'commandsEncoding',
+              'brightness', 'colorTemperature', 'commands'),
+    'media_player': ('manufacturer', 'supportedModels', 'commandsEncoding',
+                     'commands'),
+}
+
+# Parsed device files shared by every entity using the same device code,
+# keyed by (platform, device_code).
+_DEVICE_DATA_CACHE = {}
+# Loads in progress, so that entities set up in parallel wait for the same
+# executor job instead of each running their own.
+_DEVICE_DATA_LOADS = {}
+
+class _DeviceDataEntry():
+    """A parsed device file and the number of entities referencing it."""
+    def __init__(self, device_data, mtime, refs):
+        self.device_data = device_data
+        self.mtime = mtime
+        self.refs = refs
+
+async def async_get_device_data(hass, platform, config):
+    """Set up an IR platform.
+
+    The returned device data is shared between all entities using the same
+    device code and must be treated as read-only. Every successful call must
+    be paired with async_release_device_data once the entity goes away, or
+    if it is never added.
+    """
     _LOGGER.debug(f"Setting up the smartir {platform} platform")
     device_code = config.get(CONF_DEVICE_CODE)
-    device_files_subdir = os.path.join('codes', platform)
-    device_files_absdir = os.path.join(COMPONENT_ABS_DIR, device_files_subdir)
+    cache_key = (platform, device_code)
+
+    while True:
+        task = _DEVICE_DATA_LOADS.get(cache_key)
+        if task is None:
+            task = hass.async_create_task(
+                _async_load_device_data(hass, platform, device_code))
+            _DEVICE_DATA_LOADS[cache_key] = task
+            task.add_done_callback(lambda _: _DEVICE_DATA_LOADS.pop(cache_key, None))
+
+        if not await asyncio.shield(task):
+            return None
+
+        # The last entity using the file may have released it meanwhile.
+        entry = _DEVICE_DATA_CACHE.get(cache_key)
+        if entry is not None:
+            entry.refs += 1
+            return entry.device_data
+
+async def _async_load_device_data(hass, platform, device_code):
+    """Load a device file into the cache, downloading it if needed."""
+    cache_key = (platform, device_code)
+    entry = _DEVICE_DATA_CACHE.get(cache_key)
+    cached_mtime = entry.mtime if entry is not None else None
+    snapshot_dir = hass.config.path(STORAGE_DIR, DOMAIN, SNAPSHOT_SUBDIR)
+
+    try:
+        result = await hass.async_add_executor_job(
+            _load_device_data, platform, device_code, cached_mtime, snapshot_dir)
+
+        if result is None:
+            device_path, device_filename = _device_file_path(platform, device_code)
+            _LOGGER.warning(device_path)
+            _LOGGER.warning("Couldn't find the device Json file. The component will " \
+                            "try to download it from the GitHub repo.")
 
-    if not os.path.isdir(device_files_absdir):
-        os.makedirs(device_files_absdir)
+            try:
+                codes_source = ("https://raw.githubusercontent.com/"
+                                "smartHomeHub/SmartIR/master/"
+                                f"codes/{platform}/{device_filename}")
 
+                await Helper.downloader(codes_source, device_path)
+            except Exception:
+                _LOGGER.error("There was an error while downloading the device Json file. " \
+                              "Please check your internet connection or if the device code " \
+                              "exists on GitHub. If the problem still exists please " \
+                              "place the file manually in the proper directory.")
+                return False
+
+            result = await hass.async_add_executor_job(
+                _load_device_data, platform, device_code, None, snapshot_dir)
+    except Exception as e:
+        _LOGGER.exception("The device code file is invalid")
+        return False
+
+    mtime, device_data = result
+    if device_data is None:
+        _LOGGER.debug(f"smartir {platform} device {device_code} already loaded, sharing it")
+        return True
+
+    # Entities still holding a stale copy keep it until they are removed,
+    # their references carry over to the reloaded file.
+    refs = entry.refs if entry is not None else 0
+    _DEVICE_DATA_CACHE[cache_key] = _DeviceDataEntry(
+        types.MappingProxyType(device_data), mtime, refs)
+    return True
+
+def _device_file_path(platform, device_code):
+    """Return the path and file name of a device file."""
     if len(str(device_code)) > 4:
         device_filename = str(device_code) + '.py'
-        is_python = True
     else:
         device_filename = str(device_code) + '.json'
-        is_python = False
 
-    device_path = os.path.join(device_files_absdir, device_filename)
+    device_files_absdir = os.path.join(COMPONENT_ABS_DIR, 'codes', platform)
+    return os.path.join(device_files_absdir, device_filename), device_filename
 
-    if not os.path.exists(device_path):
-        _LOGGER.warning(device_path)
-        _LOGGER.warning("Couldn't find the device Json file. The component will " \
-                        "try to download it from the GitHub repo.")
+def _load_device_data(platform, device_code, cached_mtime, snapshot_dir):
+    """Find, read, parse and validate a device file.
 
-        try:
-            codes_source = ("https://raw.githubusercontent.com/"
-                            "smartHomeHub/SmartIR/master/"
-                            f"codes/{platform}/{device_filename}")
-
-            await Helper.downloader(codes_source, device_path)
-        except Exception:
-            _LOGGER.error("There was an error while downloading the device Json file. " \
-                          "Please check your internet connection or if the device code " \
-                          "exists on GitHub. If the problem still exists please " \
-                          "place the file manually in the proper directory.")
-            return None
+    Runs in the executor. Returns None if the file does not exist, and
+    (mtime, None) if it is unchanged since cached_mtime.
+    """
+    device_path, device_filename = _device_file_path(platform, device_code)
+    os.makedirs(os.path.dirname(device_path), exist_ok=True)
 
     try:
-        async with aiofiles.open(device_path, mode='r') as j:
-            _LOGGER.debug(f"loading device file {device_path}")
-            content = await j.read()
-            if is_python:
-                module = types.ModuleType('code_file', 'IR code file module')
-                exec(compile(content, device_path, 'exec'), module.__dict__)
-                device_data = module.DEVICE_DATA
-                device_data["_code_module"] = module
-            else:
-                device_data = json.loads(content)
-            _LOGGER.debug(f"{device_path} file loaded")
-    except Exception as e:
-        _LOGGER.exception("The device code file is invalid")
+        mtime = os.path.getmtime(device_path)
+    except FileNotFoundError:
         return None
 
-    return device_data
+    if mtime == cached_mtime:
+        return mtime, None
+
+    _LOGGER.debug(f"loading device file {device_path}")
+    size = os.path.getsize(device_path)
+    table = None
+
+    if device_filename.endswith('.py'):
+        module = _load_code_module(platform, device_code, device_path, mtime)
+        device_data = dict(module.DEVICE_DATA, _code_module=module)
+        _validate_device_data(platform, device_path, device_data)
+    elif platform == 'climate' and (sidecar.is_fresh(device_path) or
+                                    size >= sidecar.SIDECAR_MIN_SIZE):
+        device_data = _load_with_sidecar(device_path)
+        _validate_device_data(platform, device_path, device_data)
+    else:
+        snapshot_path = os.path.join(
+            snapshot_dir, f"{platform}_{device_code}{snapshot.SNAPSHOT_SUFFIX}")
+        digest = snapshot.file_digest(device_path)
+        device_data = snapshot.load(snapshot_path, digest)
+
+        if device_data is not None:
+            _LOGGER.debug(f"{device_path} loaded from snapshot")
+        else:
+            if size >= lazy_json.LAZY_MIN_SIZE:
+                device_data = lazy_json.load(device_path)
+            else:
+                with open(device_path, mode='r') as f:
+                    device_data = json.load(f)
+            _validate_device_data(platform, device_path, device_data)
+
+            if platform == 'climate':
+                # The snapshot keeps the problems, its commands are only
+                # compiled one mode at a time when it is loaded.
+                table, problems = command_table.compile_commands(device_data, device_path)
+                device_data[command_table.PROBLEMS_KEY] = problems
+
+            try:
+                snapshot.save(snapshot_path, digest, device_data)
+            except OSError as e:
+                _LOGGER.warning(f"Unable to write the snapshot of {device_path}: {e}")
+
+    if platform == 'climate' and '_code_module' not in device_data:
+        if table is None:
+            table, problems = command_table.compile_commands(device_data, device_path)
+        for problem in problems:
+            _LOGGER.warning(f"{device_path}: {problem}")
+        device_data = dict(device_data, _command_table=table)
+
+    _LOGGER.debug(f"{device_path} file loaded")
+    return mtime, device_data
+
+def _load_code_module(platform, device_code, device_path, mtime):
+    """Import a Python device file as smartir_codes.<platform>.<code>.
+
+    The module goes through the regular source loader, so its bytecode is
+    cached in __pycache__ and only recompiled when the file changes.
+    """
+    name = f"{CODE_MODULES_PACKAGE}.{platform}.{device_code}"
+    module = sys.modules.get(name)
+
+    if module is not None and _CODE_MODULE_MTIMES.get(name) == mtime:
+        return module
+
+    for package_name in (CODE_MODULES_PACKAGE, f"{CODE_MODULES_PACKAGE}.{platform}"):
+        if package_name not in sys.modules:
+            package = types.ModuleType(package_name, 'SmartIR code files')
+            package.__path__ = []
+            sys.modules[package_name] = package
+
+    spec = importlib.util.spec_from_file_location(name, device_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    sys.modules[name] = module
+    _CODE_MODULE_MTIMES[name] = mtime
+    return module
+
+def _validate_device_data(platform, device_path, device_data):
+    """Raise ValueError if device_data lacks keys its platform needs."""
+    missing = [key for key in REQUIRED_DEVICE_KEYS.get(platform, ())
+               if key not in device_data]
+    if missing:
+        raise ValueError(f"{device_path} is missing {', '.join(missing)}")
+    if 'commands' not in device_data and '_code_module' not in device_data:
+        raise ValueError(f"{device_path} has no commands")
+
+def _load_with_sidecar(device_path):
+    """Load a climate file through its sidecar, compiling it if needed."""
+    if not sidecar.is_fresh(device_path):
+        try:
+            if not sidecar.build(device_path, lazy_json.load(device_path)):
+                return lazy_json.load(device_path)
+        except OSError as e:
+            _LOGGER.warning(f"Unable to write the sidecar of {device_path}: {e}")
+            return lazy_json.load(device_path)
+
+    return sidecar.load(device_path)
+
+def static_attributes(device_code, device_data):
+    """Return the read-only STATIC_ATTRIBUTES of an entity."""
+    return types.MappingProxyType({
+        'device_code': device_code,
+        'manufacturer': device_data['manufacturer'],
+        'supported_models': device_data['supportedModels'],
+        'default_controller': device_data.get('defaultController', None),
+        'commands_encoding': device_data['commandsEncoding'],
+    })
+
+def async_release_device_data(platform, device_code):
+    """Drop a reference taken by async_get_device_data."""
+    cache_key = (platform, device_code)
+    entry = _DEVICE_DATA_CACHE.get(cache_key)
+
+    if entry is None:
+        return
+
+    entry.refs -= 1
+    if entry.refs <= 0:
+        _LOGGER.debug(f"Evicting smartir {platform} device {device_code}")
+        del _DEVICE_DATA_CACHE[cache_key]
 
 async def async_setup(hass, config):
     """Set up the SmartIR component."""
     conf = config.get(DOMAIN)
 
+    async def _get_stats(service):
+        from .controller import get_stats
+        stats = get_stats()
+
+        climate = sys.modules.get(f"{__name__}.climate")
+        if climate is not None:
+            stats['climate_sensor_writes'] = climate.get_sensor_write_stats()
+        return stats
+
+    hass.services.async_register(
+        DOMAIN, 'get_stats', _get_stats,
+        supports_response=SupportsResponse.ONLY)
+
     if conf is None:
         return True
 
     check_updates = conf[CONF_CHECK_UPDATES]
     update_branch = conf[CONF_UPDATE_BRANCH]
 
+    from .controller import set_lookin_options
+    set_lookin_options(conf[CONF_LOOKIN_TIMEOUT], conf[CONF_LOOKIN_MAX_CONCURRENCY])
+
+    if conf[CONF_PERSISTENT_CONVERSION_CACHE]:
+        from .controller import set_conversion_store
+        from .conversion_store import ConversionStore
+
+        store = ConversionStore(
+            hass, hass.config.path(STORAGE_DIR, DOMAIN, CONVERSION_STORE_FILE),
+            conf[CONF_PERSISTENT_CONVERSION_CACHE_SIZE])
+        try:
+            await store.async_load()
+            set_conversion_store(store)
+        except Exception:
+            _LOGGER.exception("Unable to open the persistent conversion cache")
+
     async def _check_updates(service):
         await _update(hass, update_branch)
 
@@ -0,0 +1,230 @@
+"""Direct UDP transport to Broadlink devices.
+
+Talks the Broadlink LAN protocol to a device, without going through the
+Broadlink integration: the device is looked up with a hello packet,
+authenticated once, and IR packets are then sent as encrypted send_data
+requests over the same socket. The session is set up again when the device
+stops answering or rejects the session key.
+"""
+import asyncio
+import logging
+import socket
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+_LOGGER = logging.getLogger(__name__)
+
+BROADLINK_PORT = 80
+# Seconds to wait for the answer to a request.
+REQUEST_TIMEOUT = 2
+# Number of times a request is sent again after a timeout or an auth error.
+REQUEST_RETRIES = 2
+
+CMD_HELLO = 0x06
+CMD_AUTH = 0x65
+CMD_COMMAND = 0x6A
+
+ERROR_AUTH = -7
+
+DEFAULT_KEY = bytes.fromhex('097628343fe99e23765c1513accf8b02')
+DEFAULT_IV = bytes.fromhex('562e17996d093d28ddb3ba695a2e6f58')
+_MAGIC = bytes.fromhex('5aa5aa555aa5aa55')
+
+# The RM mini 3 from firmware 44057 on and the RM4 series prefix the payload
+# of commands with its length; their device types all start from 0x5000.
+LENGTH_PREFIX_MIN_DEVTYPE = 0x5000
+
+
+class BroadlinkError(Exception):
+    """A Broadlink device rejected a request or did not answer."""
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+def _checksum(data):
+    return (sum(data) + 0xBEAF) & 0xFFFF
+
+
+class _Protocol(asyncio.DatagramProtocol):
+    def __init__(self, device):
+        self._device = device
+        self._transport = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def datagram_received(self, data, addr):
+        if self._transport is self._device._transport:
+            self._device._received(data)
+
+    def error_received(self, exc):
+        if self._transport is self._device._transport:
+            self._device._failed(exc)
+
+    def connection_lost(self, exc):
+        if self._transport is self._device._transport:
+            self._device._lost()
+
+
+class BroadlinkDevice():
+    """An authenticated UDP session with one Broadlink device."""
+    def __init__(self, host, port=BROADLINK_PORT):
+        self.host = host
+        self.port = port
+        self._transport = None
+        self._response = None
+        self._expected_count = None
+        self._lock = asyncio.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._key = DEFAULT_KEY
+        self._id = 0
+        self._count = 0
+        self._devtype = None
+        self._mac = bytes(6)
+        self._authenticated = False
+
+    def _received(self, data):
+        # Late answers to an earlier, timed out request are dropped.
+        if self._expected_count is not None and data[0x28:0x2A] != self._expected_count:
+            return
+        if self._response is not None and not self._response.done():
+            self._response.set_result(data)
+
+    def _failed(self, exc):
+        if self._response is not None and not self._response.done():
+            self._response.set_exception(exc)
+
+    def _lost(self):
+        self._transport = None
+        self._reset()
+
+    def close(self):
+        """Close the socket, the next request sets the session up again."""
+        if self._transport is not None:
+            self._transport.close()
+        self._transport = None
+        self._reset()
+
+    def _cipher(self):
+        return Cipher(algorithms.AES(self._key), modes.CBC(DEFAULT_IV))
+
+    def _encrypt(self, payload):
+        encryptor = self._cipher().encryptor()
+        return encryptor.update(payload) + encryptor.finalize()
+
+    def _decrypt(self, payload):
+        decryptor = self._cipher().decryptor()
+        return decryptor.update(payload) + decryptor.finalize()
+
+    async def _request(self, packet, count=None):
+        """Send a packet and return the answer of the device."""
+        self._response = asyncio.get_running_loop().create_future()
+        self._expected_count = count
+        try:
+            self._transport.sendto(packet)
+            async with asyncio.timeout(REQUEST_TIMEOUT):
+                return await self._response
+        finally:
+            self._response = None
+
+    async def _connect(self):
+        """Open the socket, then identify and authenticate with the device."""
+        self.close()
+        self._transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: _Protocol(self), remote_addr=(self.host, self.port))
+        await self._hello()
+        await self._authenticate()
+
+    async def _hello(self):
+        """Read the device type and MAC address of the device."""
+        address, port = self._transport.get_extra_info('sockname')[:2]
+        packet = bytearray(0x30)
+        packet[0x18:0x1C] = socket.inet_aton(address)[::-1]
+        packet[0x1C:0x1E] = port.to_bytes(2, 'little')
+        packet[0x26] = CMD_HELLO
+        packet[0x20:0x22] = _checksum(packet).to_bytes(2, 'little')
+
+        response = await self._request(packet)
+        if len(response) < 0x40:
+            raise BroadlinkError(f"Invalid hello response from {self.host}")
+
+        self._devtype = int.from_bytes(response[0x34:0x36], 'little')
+        self._mac = bytes(response[0x3A:0x40])
+
+    async def _authenticate(self):
+        """Exchange the default key for a session key and id."""
+        payload = bytearray(0x50)
+        payload[0x04:0x14] = b'\x31' * 16
+        payload[0x1E] = 0x01
+        payload[0x2D] = 0x01
+        payload[0x30:0x36] = b'Test 1'
+
+        response = await self._send_packet(CMD_AUTH, payload)
+        self._id = int.from_bytes(response[0x00:0x04], 'little')
+        self._key = bytes(response[0x04:0x14])
+        self._authenticated = True
+        _LOGGER.debug(f"Authenticated with Broadlink device {self.host} (type {self._devtype:#06x})")
+
+    async def _send_packet(self, command, payload):
+        """Send an encrypted request and return its decrypted payload."""
+        self._count = (self._count + 1) & 0xFFFF
+        packet = bytearray(0x38)
+        packet[0x00:0x08] = _MAGIC
+        packet[0x24:0x26] = self._devtype.to_bytes(2, 'little')
+        packet[0x26:0x28] = command.to_bytes(2, 'little')
+        packet[0x28:0x2A] = self._count.to_bytes(2, 'little')
+        packet[0x2A:0x30] = self._mac
+        packet[0x30:0x34] = self._id.to_bytes(4, 'little')
+
+        payload = bytes(payload) + bytes(-len(payload) % 16)
+        packet[0x34:0x36] = _checksum(payload).to_bytes(2, 'little')
+        packet.extend(self._encrypt(payload))
+        packet[0x20:0x22] = _checksum(packet).to_bytes(2, 'little')
+
+        response = await self._request(packet, bytes(packet[0x28:0x2A]))
+        if len(response) < 0x38:
+            raise BroadlinkError(f"Invalid response from {self.host}")
+
+        error = int.from_bytes(response[0x22:0x24], 'little', signed=True)
+        if error:
+            raise BroadlinkError(f"{self.host} returned error {error}", error)
+        return self._decrypt(bytes(response[0x38:]))
+
+    def _command_payload(self, data):
+        payload = b'\x02\x00\x00\x00' + data
+        if self._devtype >= LENGTH_PREFIX_MIN_DEVTYPE:
+            payload = len(payload).to_bytes(2, 'little') + payload
+        return payload
+
+    async def send_data(self, data):
+        """Send an IR/RF packet (a memoryview or bytes) to the device."""
+        async with self._lock:
+            for attempt in range(REQUEST_RETRIES + 1):
+                try:
+                    if not self._authenticated:
+                        await self._connect()
+                    await self._send_packet(CMD_COMMAND, self._command_payload(data))
+                    return
+                except (TimeoutError, OSError, BroadlinkError) as e:
+                    retry = not isinstance(e, BroadlinkError) or e.code in (None, ERROR_AUTH)
+                    if attempt == REQUEST_RETRIES or not retry:
+                        raise
+                    _LOGGER.debug(f"Setting up the session with {self.host} again: {e!r}")
+                    self.close()
+
+
+# Devices keyed by host.
+_devices = {}
+
+def get_device(host):
+    """Return the BroadlinkDevice of host, shared by every controller."""
+    device = _devices.get(host)
+
+    if device is None:
+        device = BroadlinkDevice(host)
+        _devices[host] = device
+
+    return device
@@ -1,8 +1,11 @@
 import asyncio
 import aiofiles
+import itertools
 import json
 import logging
 import os.path
+import time
+import weakref
 
 import voluptuous as vol
 
@@ -13,12 +16,15 @@ from homeassistant.const import (
     CONF_NAME, STATE_ON, STATE_OFF, STATE_UNKNOWN, STATE_UNAVAILABLE, ATTR_TEMPERATURE,
     PRECISION_TENTHS, PRECISION_HALVES, PRECISION_WHOLE)
 from homeassistant.core import Event, EventStateChangedData, callback
-from homeassistant.helpers.event import async_track_state_change, async_track_state_change_event
+from homeassistant.helpers.debounce import Debouncer
+from homeassistant.helpers.event import (
+    async_call_later, async_track_state_change, async_track_state_change_event)
 import homeassistant.helpers.config_validation as cv
 from homeassistant.helpers.restore_state import RestoreEntity
 from homeassistant.helpers.discovery import async_load_platform
-from . import COMPONENT_ABS_DIR, Helper, async_get_device_data, CONF_DEVICE_CODE, DOMAIN
-from .controller import get_controller
+from . import COMPONENT_ABS_DIR, Helper, async_get_device_data, async_release_device_data, static_attributes, STATIC_ATTRIBUTES, CONF_DEVICE_CODE, DOMAIN
+from .controller import (
+    FANOUT_ALL, FANOUT_FIRST, async_offload_conversion, get_controller)
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -28,11 +34,33 @@ DEFAULT_DELAY = 0.5
 CONF_UNIQUE_ID = 'unique_id'
 CONF_CONTROLLER_TYPE = "controller_type"
 CONF_CONTROLLER_DATA = "controller_data"
+CONF_FANOUT_MODE = "fanout_mode"
 CONF_DELAY = "delay"
+CONF_PROTOCOL_PAYLOADS = "protocol_payloads"
 CONF_TEMPERATURE_SENSOR = 'temperature_sensor'
 CONF_HUMIDITY_SENSOR = 'humidity_sensor'
 CONF_POWER_SENSOR = 'power_sensor'
 CONF_POWER_SENSOR_RESTORE_STATE = 'power_sensor_restore_state'
+CONF_PRECOMPUTE_COMMANDS = 'precompute_commands'
+CONF_COMMAND_DEBOUNCE = 'command_debounce'
+CONF_SENSOR_MIN_INTERVAL = 'sensor_min_interval'
+CONF_TEMPERATURE_MIN_DELTA = 'temperature_min_delta'
+CONF_HUMIDITY_MIN_DELTA = 'humidity_min_delta'
+CONF_NEAREST_COMMAND_FALLBACK = 'nearest_command_fallback'
+
+# Seconds after which a sensor value held back by the minimum deltas is
+# still published, when no sensor_min_interval is set.
+SENSOR_TRAILING_DELAY = 60
+
+# State writes caused by sensor changes, per entity_id.
+_SENSOR_WRITE_STATS = {}
+
+# Upper bound of generator states filled in by precompute_commands.
+PRECOMPUTE_MAX_STATES = 50000
+
+# Converted generator output, per code module and shared by all entities
+# using it: {(controller encoding, sorted args): command}.
+_GENERATOR_CACHES = weakref.WeakKeyDictionary()
 
 SUPPORT_FLAGS = (
     ClimateEntityFeature.TURN_OFF |
@@ -46,23 +74,39 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
     vol.Optional(CONF_NAME, default=DEFAULT_NAME): cv.string,
     vol.Required(CONF_DEVICE_CODE): cv.positive_int,
     vol.Optional(CONF_CONTROLLER_TYPE): cv.string,
-    vol.Required(CONF_CONTROLLER_DATA): cv.string,
+    vol.Required(CONF_CONTROLLER_DATA): vol.Any(
+        cv.string, vol.All([cv.string], vol.Length(min=1))),
+    vol.Optional(CONF_FANOUT_MODE, default=FANOUT_ALL): vol.In(
+        [FANOUT_ALL, FANOUT_FIRST]),
     vol.Optional(CONF_DELAY, default=DEFAULT_DELAY): cv.positive_float,
+    vol.Optional(CONF_PROTOCOL_PAYLOADS, default=False): cv.boolean,
     vol.Optional(CONF_TEMPERATURE_SENSOR): cv.entity_id,
     vol.Optional(CONF_HUMIDITY_SENSOR): cv.entity_id,
     vol.Optional(CONF_POWER_SENSOR): cv.entity_id,
-    vol.Optional(CONF_POWER_SENSOR_RESTORE_STATE, default=False): cv.boolean
+    vol.Optional(CONF_POWER_SENSOR_RESTORE_STATE, default=False): cv.boolean,
+    vol.Optional(CONF_PRECOMPUTE_COMMANDS, default=False): cv.boolean,
+    vol.Optional(CONF_COMMAND_DEBOUNCE, default=0): cv.positive_float,
+    vol.Optional(CONF_SENSOR_MIN_INTERVAL, default=0): cv.positive_float,
+    vol.Optional(CONF_TEMPERATURE_MIN_DELTA, default=0): cv.positive_float,
+    vol.Optional(CONF_HUMIDITY_MIN_DELTA, default=0): cv.positive_float,
+    vol.Optional(CONF_NEAREST_COMMAND_FALLBACK, default=False): cv.boolean
 })
 
+def get_sensor_write_stats():
+    """Return the written and suppressed sensor state writes per entity."""
+    return {entity_id: dict(stats) for entity_id, stats in _SENSOR_WRITE_STATS.items()}
+
 async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up the IR Climate platform."""
-    device_data = await async_get_device_data('climate', config)
+    device_data = await async_get_device_data(hass, 'climate', config)
     if device_data is None:
         return
 
-    entity = SmartIRClimate(
-        hass, config, device_data
-    )
+    try:
+        entity = SmartIRClimate(hass, config, device_data)
+    except Exception:
+        async_release_device_data('climate', config.get(CONF_DEVICE_CODE))
+        raise
     async_add_entities([entity])
 
     for i in entity._toggle_state:
@@ -78,6 +122,8 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
         }, config)
 
 class SmartIRClimate(ClimateEntity, RestoreEntity):
+    _unrecorded_attributes = STATIC_ATTRIBUTES
+
     def __init__(self, hass, config, device_data):
         _LOGGER.debug(f"SmartIRClimate init started for device {config.get(CONF_NAME)} supported models {device_data['supportedModels']}")
         self.hass = hass
@@ -85,17 +131,31 @@ class SmartIRClimate(ClimateEntity, RestoreEntity):
         self._name = config.get(CONF_NAME)
         self._device_code = config.get(CONF_DEVICE_CODE)
         self._controller_data = config.get(CONF_CONTROLLER_DATA)
+        self._fanout_mode = config.get(CONF_FANOUT_MODE)
         self._delay = config.get(CONF_DELAY)
+        self._protocol_payloads = config.get(CONF_PROTOCOL_PAYLOADS)
         self._temperature_sensor = config.get(CONF_TEMPERATURE_SENSOR)
         self._humidity_sensor = config.get(CONF_HUMIDITY_SENSOR)
         self._power_sensor = config.get(CONF_POWER_SENSOR)
         self._power_sensor_restore_state = config.get(CONF_POWER_SENSOR_RESTORE_STATE)
+        self._precompute_commands = config.get(CONF_PRECOMPUTE_COMMANDS)
+        self._sensor_min_interval = config.get(CONF_SENSOR_MIN_INTERVAL)
+        self._temperature_min_delta = config.get(CONF_TEMPERATURE_MIN_DELTA)
+        self._humidity_min_delta = config.get(CONF_HUMIDITY_MIN_DELTA)
+        self._nearest_command_fallback = config.get(CONF_NEAREST_COMMAND_FALLBACK)
+        self._published_temperature = None
+        self._published_humidity = None
+        self._last_sensor_write = 0
+        self._sensor_write_at = None
+        self._cancel_sensor_write = None
+        self._sensor_write_stats = {'written': 0, 'suppressed': 0}
         self._attr_translation_key = "smartir_climate"
 
         self._manufacturer = device_data['manufacturer']
         self._supported_models = device_data['supportedModels']
         self._default_controller = device_data.get('defaultController', None)
         self._commands_encoding = device_data['commandsEncoding']
+        self._static_attributes = static_attributes(self._device_code, device_data)
         self._min_temperature = device_data['minTemperature']
         self._max_temperature = device_data['maxTemperature']
         self._per_mode_range = isinstance(self._min_temperature, dict)
@@ -110,6 +170,7 @@ class SmartIRClimate(ClimateEntity, RestoreEntity):
         self._swing_modes = device_data.get('swingModes')
         self._commands = device_data.get('commands')
         self._code_module = device_data.get('_code_module')
+        self._command_table = device_data.get('_command_table')
 
         if self._per_mode_range:
             self._target_temperatures = {}
@@ -140,13 +201,25 @@ class SmartIRClimate(ClimateEntity, RestoreEntity):
         self._temp_lock = asyncio.Lock()
         self._on_by_remote = False
 
+        # Coalesce state changes made in quick succession into one send of
+        # the latest state.
+        self._debouncer = None
+        self._send_pending = False
+        if config.get(CONF_COMMAND_DEBOUNCE):
+            self._debouncer = Debouncer(
+                hass, _LOGGER,
+                cooldown=config.get(CONF_COMMAND_DEBOUNCE),
+                immediate=False,
+                function=self._async_send_latest)
+
         #Init the IR/RF controller
         self._controller = get_controller(
             self.hass,
             self._controller_type,
             self._commands_encoding,
             self._controller_data,
-            self._delay)
+            self._protocol_payloads,
+            self._fanout_mode)
 
 
         self._actions = device_data.get('actions', [])
@@ -177,6 +250,9 @@ class SmartIRClimate(ClimateEntity, RestoreEntity):
                 if i in last_state.attributes:
                     self._toggle_state[i] = last_state.attributes[i]
 
+        if self._temperature_sensor or self._humidity_sensor:
+            _SENSOR_WRITE_STATS[self.entity_id] = self._sensor_write_stats
+
         if self._temperature_sensor:
             async_track_state_change_event(self.hass, self._temperature_sensor, 
                                            self._async_temp_sensor_changed)
@@ -197,6 +273,27 @@ class SmartIRClimate(ClimateEntity, RestoreEntity):
             async_track_state_change_event(self.hass, self._power_sensor, 
                                            self._async_power_sensor_changed)
 
+        if self._code_module and self._precompute_commands:
+            self.hass.async_create_background_task(
+                self._async_precompute_generator_commands(),
+                f"smartir precompute {self._name}")
+
+    def add_to_platform_abort(self):
+        """Release the shared device data of an entity never added."""
+        super().add_to_platform_abort()
+        async_release_device_data('climate', self._device_code)
+
+    async def async_will_remove_from_hass(self):
+        """Release the shared device data."""
+        await super().async_will_remove_from_hass()
+        if self._debouncer is not None:
+            self._debouncer.async_cancel()
+        if self._cancel_sensor_write is not None:
+            self._cancel_sensor_write()
+            self._cancel_sensor_write = None
+        _SENSOR_WRITE_STATS.pop(self.entity_id, None)
+        async_release_device_data('climate', self._device_code)
+
     @property
     def unique_id(self):
         """Return a unique ID."""
@@ -308,12 +405,8 @@ class SmartIRClimate(ClimateEntity, RestoreEntity):
     def extra_state_attributes(self):
         """Platform specific attributes."""
         state = {
+            **self._static_attributes,
             'last_on_operation': self._last_on_operation,
-            'device_code': self._device_code,
-            'manufacturer': self._manufacturer,
-            'supported_models': self._supported_models,
-            'default_controller': self._default_controller,
-            'commands_encoding': self._commands_encoding
         }
         if self._per_mode_range:
             state['target_temperatures'] = self._target_temperatures
@@ -407,6 +500,25 @@ class SmartIRClimate(ClimateEntity, RestoreEntity):
             await self.async_set_hvac_mode(self._operation_modes[1])
 
     async def send_command(self, action=None):
+        """Send the current state, or schedule it if debouncing."""
+        if self._debouncer is not None and action is None:
+            self._send_pending = True
+            await self._debouncer.async_call()
+            return
+
+        await self._async_send_command(action)
+
+    async def _async_send_latest(self):
+        """Send the current state until it no longer changes during a send.
+
+        The debouncer ignores calls made while it runs, so changes made
+        while a command is on its way are sent right after it.
+        """
+        while self._send_pending:
+            self._send_pending = False
+            await self._async_send_command()
+
+    async def _async_send_command(self, action=None):
         async with self._temp_lock:
             try:
                 self._on_by_remote = False
@@ -416,41 +528,117 @@ class SmartIRClimate(ClimateEntity, RestoreEntity):
                 target_temperature = self._target_temperature
 
                 if self._code_module:
-                    args = {
-                        "hvac_mode": operation_mode,
-                        "fan_mode": fan_mode,
-                        "temp": target_temperature,
-                    }
-
-                    if self._support_swing:
-                        args["swing_mode"] = swing_mode
-
-                    if action is not None:
-                        args["action"] = action
-
-                    args.update(self._toggle_state)
-                    code = self._code_module.command(**args)
-                    await self._controller.send(code)
+                    args = self._generator_args(
+                        operation_mode, fan_mode, swing_mode,
+                        target_temperature, self._toggle_state, action)
+                    cache = _GENERATOR_CACHES.setdefault(self._code_module, {})
+                    command = self._cached_generator_command(cache, args)
+                    if command is None:
+                        command = await async_offload_conversion(
+                            self.hass, self._generator_command, cache, args)
+                    await self._controller.send_converted(command, self._delay)
                 else:
-                    target_temperature = '{0:g}'.format(target_temperature)
                     if operation_mode.lower() == HVACMode.OFF:
-                        await self._controller.send(self._commands['off'])
+                        await self._controller.send(self._commands['off'], self._delay)
                         return
 
-                    if 'on' in self._commands:
-                        await self._controller.send(self._commands['on'])
-                        await asyncio.sleep(self._delay)
+                    command = self._command_table.get(
+                        operation_mode, fan_mode, swing_mode, target_temperature,
+                        self._nearest_command_fallback)
+                    if command is None:
+                        _LOGGER.error(f"{self._name}: no command for mode {operation_mode}, "
+                                      f"fan {fan_mode}, swing {swing_mode}, "
+                                      f"temperature {target_temperature}")
+                        return
 
-                    if self._support_swing == True:
-                        await self._controller.send(
-                            self._commands[operation_mode][fan_mode][swing_mode][target_temperature])
+                    if 'on' in self._commands:
+                        # The device gets the full delay to power on.
+                        await self._controller.send_batch(
+                            [self._commands['on'], command], self._delay, None)
                     else:
-                        await self._controller.send(
-                            self._commands[operation_mode][fan_mode][target_temperature])
+                        await self._controller.send(command, self._delay)
 
             except Exception as e:
                 _LOGGER.exception(e)
                 
+    def _generator_args(self, hvac_mode, fan_mode, swing_mode, temperature,
+                        toggles, action=None):
+        """Return the arguments of the code module's command()."""
+        args = {
+            "hvac_mode": hvac_mode,
+            "fan_mode": fan_mode,
+            "temp": temperature,
+        }
+
+        if self._support_swing:
+            args["swing_mode"] = swing_mode
+
+        if action is not None:
+            args["action"] = action
+
+        args.update(toggles)
+        return args
+
+    def _cached_generator_command(self, cache, args):
+        """Return the memoized code module output for args, or None."""
+        return cache.get((self._controller.encoding, tuple(sorted(args.items()))))
+
+    def _generator_command(self, cache, args):
+        """Return the converted code module output for args, memoized."""
+        key = (self._controller.encoding, tuple(sorted(args.items())))
+        command = cache.get(key)
+
+        if command is None:
+            command = self._controller.convert(self._code_module.command(**args))
+            cache[key] = command
+
+        return command
+
+    async def _async_precompute_generator_commands(self):
+        """Fill the generator cache in the executor."""
+        await self.hass.async_add_executor_job(
+            self._precompute_generator_commands,
+            _GENERATOR_CACHES.setdefault(self._code_module, {}))
+
+    def _precompute_generator_commands(self, cache):
+        """Fill the generator cache with every reachable state."""
+        toggle_states = [
+            dict(zip(self._toggle_state, values))
+            for values in itertools.product((False, True), repeat=len(self._toggle_state))]
+        count = 0
+
+        for hvac_mode in self._operation_modes[1:]:
+            if self._per_mode_range:
+                if hvac_mode not in self._min_temperature:
+                    continue
+                min_temp = self._min_temperature[hvac_mode]
+                max_temp = self._max_temperature[hvac_mode]
+            else:
+                min_temp = self._min_temperature
+                max_temp = self._max_temperature
+
+            steps = int(round((max_temp - min_temp) / self._precision))
+            temperatures = [round(min_temp + i * self._precision, 1) for i in range(steps + 1)]
+            if self._precision == PRECISION_WHOLE:
+                temperatures = [round(t) for t in temperatures]
+
+            for fan_mode, swing_mode, temperature, toggles in itertools.product(
+                    self._fan_modes, self._swing_modes or [None], temperatures, toggle_states):
+                if count >= PRECOMPUTE_MAX_STATES:
+                    _LOGGER.warning(f"{self._name}: stopped precomputing commands "
+                                    f"after {PRECOMPUTE_MAX_STATES} states")
+                    return
+                count += 1
+
+                args = self._generator_args(
+                    hvac_mode, fan_mode, swing_mode, temperature, toggles)
+                try:
+                    self._generator_command(cache, args)
+                except Exception as e:
+                    _LOGGER.debug(f"{self._name}: no command for {args}: {e}")
+
+        _LOGGER.debug(f"{self._name}: precomputed {count} generator states")
+
     @callback
     async def _async_temp_sensor_changed(self, event: Event[EventStateChangedData]) -> None:
         """Handle temperature sensor changes."""
@@ -460,7 +648,7 @@ class SmartIRClimate(ClimateEntity, RestoreEntity):
             return
 
         self._async_update_temp(new_state)
-        self.async_write_ha_state()
+        self._async_write_sensor_state()
 
     @callback
     async def _async_humidity_sensor_changed(self, event: Event[EventStateChangedData]) -> None:
@@ -471,7 +659,7 @@ class SmartIRClimate(ClimateEntity, RestoreEntity):
             return
 
         self._async_update_humidity(new_state)
-        self.async_write_ha_state()
+        self._async_write_sensor_state()
         
     @callback
     async def _async_power_sensor_changed(self, event: Event[EventStateChangedData]) -> None:
@@ -500,6 +688,69 @@ class SmartIRClimate(ClimateEntity, RestoreEntity):
                 self._hvac_mode = HVACMode.OFF
             self.async_write_ha_state()
 
+    def _sensor_changes(self):
+        """Return (changed, significant) for the unpublished sensor values."""
+        changed = significant = False
+        for value, published, min_delta in (
+                (self._current_temperature, self._published_temperature, self._temperature_min_delta),
+                (self._current_humidity, self._published_humidity, self._humidity_min_delta)):
+            if value == published:
+                continue
+            changed = True
+            if value is None or published is None or abs(value - published) >= min_delta:
+                significant = True
+        return changed, significant
+
+    @callback
+    def _async_write_sensor_state(self):
+        """Write the state for a sensor change, unless it is throttled.
+
+        Changes smaller than the minimum deltas or coming less than
+        sensor_min_interval after the last sensor write are held back and
+        published by a trailing write instead.
+        """
+        changed, significant = self._sensor_changes()
+        if not changed:
+            return
+
+        wait = self._last_sensor_write + self._sensor_min_interval - time.monotonic()
+        if significant and wait <= 0:
+            self._async_publish_sensor_state()
+            return
+
+        self._sensor_write_stats['suppressed'] += 1
+        if not significant:
+            wait = self._sensor_min_interval or SENSOR_TRAILING_DELAY
+        write_at = time.monotonic() + max(wait, 0)
+
+        if self._sensor_write_at is not None and self._sensor_write_at <= write_at:
+            return
+        if self._cancel_sensor_write is not None:
+            self._cancel_sensor_write()
+        self._sensor_write_at = write_at
+        self._cancel_sensor_write = async_call_later(
+            self.hass, max(wait, 0), self._async_trailing_sensor_write)
+
+    @callback
+    def _async_trailing_sensor_write(self, _now):
+        self._cancel_sensor_write = None
+        self._sensor_write_at = None
+        if self._sensor_changes()[0]:
+            self._async_publish_sensor_state()
+
+    @callback
+    def _async_publish_sensor_state(self):
+        if self._cancel_sensor_write is not None:
+            self._cancel_sensor_write()
+            self._cancel_sensor_write = None
+            self._sensor_write_at = None
+
+        self._published_temperature = self._current_temperature
+        self._published_humidity = self._current_humidity
+        self._last_sensor_write = time.monotonic()
+        self._sensor_write_stats['written'] += 1
+        self.async_write_ha_state()
+
     @callback
     def _async_update_temp(self, state):
         """Update thermostat with latest state from temperature sensor."""
@@ -0,0 +1,252 @@
+"""Flat command tables of JSON climate devices.
+
+The nested commands tree of a climate device file is compiled into a dict
+keyed by (mode, fan, swing, temperature), identical codes being interned,
+so sending a command is a single lookup. Combinations the device
+advertises but the tree lacks, and leaves that are not codes, are reported
+when they are compiled rather than when the command is sent.
+
+Fully parsed files and sidecars are compiled at load. Lazily loaded
+commands (large files and snapshots) are compiled one mode at a time on
+first use, so that the modes never used are never decoded. Their problems
+are found when the file is parsed, one mode at a time, and kept in the
+snapshot under PROBLEMS_KEY so they are reported on every load.
+"""
+from collections.abc import Mapping
+import bisect
+import itertools
+import sys
+
+from .sidecar import SidecarCommands
+
+# Number of missing combinations listed in a report.
+REPORT_MAX_KEYS = 5
+
+# Device data key of the problems found when lazy commands were parsed.
+PROBLEMS_KEY = '_problems'
+
+
+def temperature_key(temperature):
+    """Return the table key of a temperature, so 22, 22.0 and '22' match."""
+    return round(float(temperature), 1)
+
+
+def _temperature_key_or_none(temperature):
+    try:
+        return temperature_key(temperature)
+    except ValueError:
+        return None
+
+
+class CommandTable():
+    """The codes of a climate device keyed by (mode, fan, swing, temp).
+
+    Swing is None for devices without swing modes. Modes are compiled by
+    compile(), or on their first lookup. Problems are only returned by
+    compile(), compile_commands reports them when the device is loaded.
+    """
+    def __init__(self, device_data, name):
+        self._device_data = device_data
+        self._commands = device_data['commands']
+        self._name = name
+        self._swing = bool(device_data.get('swingModes'))
+        self._entries = {}
+        self._temperatures = {}
+        self._compiled = set()
+
+    def compile(self, modes=None):
+        """Compile modes, all of them by default, and return the problems."""
+        problems = []
+        for mode in modes or self._device_data['operationModes']:
+            if mode not in self._compiled:
+                self._compiled.add(mode)
+                problems.extend(self._compile_mode(mode))
+                problems.extend(self._missing(mode))
+
+        for temperatures in self._temperatures.values():
+            temperatures.sort()
+        return problems
+
+    def get(self, mode, fan, swing, temperature, nearest=False):
+        """Return the code of a state, or None if the device has none.
+
+        With nearest, a missing temperature falls back to the closest one
+        the device has a code for in the same mode, fan and swing.
+        """
+        if mode not in self._compiled:
+            self.compile([mode])
+
+        if not self._swing:
+            swing = None
+        temperature = temperature_key(temperature)
+        command = self._lookup((mode, fan, swing, temperature))
+
+        if command is None and nearest:
+            temperatures = self._temperatures.get((mode, fan, swing))
+            if temperatures:
+                i = bisect.bisect_left(temperatures, temperature)
+                closest = min(temperatures[max(i - 1, 0):i + 1],
+                              key=lambda t: abs(t - temperature))
+                command = self._lookup((mode, fan, swing, closest))
+
+        return command
+
+    def _lookup(self, key):
+        return self._entries.get(key)
+
+    def _add(self, mode, fan, swing, temperature, command=None):
+        self._temperatures.setdefault((mode, fan, swing), []).append(temperature)
+        if command is not None:
+            self._entries[(mode, fan, swing, temperature)] = command
+
+    def _compile_mode(self, mode):
+        """Flatten the commands of mode, returning the problems found."""
+        depth = 4 if self._swing else 3
+        problems = []
+
+        def walk(node, path):
+            for key, value in node.items():
+                name = '/'.join(path + (key,))
+                if len(path) < depth - 1:
+                    if isinstance(value, Mapping):
+                        walk(value, path + (key,))
+                    else:
+                        problems.append(f"{name} is not a mapping")
+                    continue
+
+                temperature = _temperature_key_or_none(key)
+                if temperature is None:
+                    problems.append(f"{name} is not a temperature")
+                    continue
+
+                if isinstance(value, (str, list)) and value:
+                    if isinstance(value, str):
+                        value = sys.intern(value)
+                else:
+                    problems.append(f"{name} is not a code")
+                    continue
+
+                if isinstance(node, dict):
+                    node[key] = value
+                state = path if depth == 4 else path + (None,)
+                self._add(*state, temperature, value)
+
+        node = self._commands.get(mode)
+        if isinstance(node, Mapping):
+            walk(node, (mode,))
+        elif node is not None:
+            problems.append(f"{mode} is not a mapping")
+        return problems
+
+    def _missing(self, mode):
+        """Return the problem of advertised combinations of mode with no code."""
+        device_data = self._device_data
+        min_temp = device_data['minTemperature']
+        max_temp = device_data['maxTemperature']
+        precision = device_data['precision']
+
+        if isinstance(min_temp, dict):
+            if mode not in min_temp:
+                return []
+            min_temp, max_temp = min_temp[mode], max_temp[mode]
+
+        steps = int(round((max_temp - min_temp) / precision))
+        expected = [temperature_key(min_temp + i * precision) for i in range(steps + 1)]
+        missing = []
+
+        for fan, swing in itertools.product(
+                device_data['fanModes'], device_data.get('swingModes') or [None]):
+            present = set(self._temperatures.get((mode, fan, swing), ()))
+            missing.extend(
+                '/'.join(k for k in (mode, fan, swing, f"{t:g}") if k is not None)
+                for t in expected if t not in present)
+
+        if not missing:
+            return []
+
+        shown = ', '.join(missing[:REPORT_MAX_KEYS])
+        more = len(missing) - REPORT_MAX_KEYS
+        return [f"{len(missing)} combinations have no code: {shown}"
+                + (f" and {more} more" if more > 0 else "")]
+
+
+class SidecarCommandTable(CommandTable):
+    """A CommandTable reading its codes from a sidecar on lookup."""
+    def __init__(self, device_data, name):
+        super().__init__(device_data, name)
+        self._temperature_names = {}
+        self._axis_problems = []
+
+        for key in self._commands.axes[-1]:
+            temperature = _temperature_key_or_none(key)
+            if temperature is None:
+                self._axis_problems.append(f"{key} is not a temperature")
+            else:
+                self._temperature_names.setdefault(temperature, key)
+
+    def compile(self, modes=None):
+        problems, self._axis_problems = self._axis_problems, []
+        return problems + super().compile(modes)
+
+    def _lookup(self, key):
+        mode, fan, swing, temperature = key
+        name = self._temperature_names.get(temperature)
+        if name is None:
+            return None
+        if swing is None:
+            return self._commands.lookup(mode, fan, name)
+        return self._commands.lookup(mode, fan, swing, name)
+
+    def _compile_mode(self, mode):
+        """Index the codes of mode present in the sidecar."""
+        axes = self._commands.axes
+        if mode not in axes[0]:
+            return []
+
+        for path in itertools.product(*axes[1:-1]):
+            for temperature, name in self._temperature_names.items():
+                if self._commands.has(mode, *path, name):
+                    state = (mode,) + path if len(path) == 2 else (mode,) + path + (None,)
+                    self._add(*state, temperature)
+        return []
+
+
+def _lazy_problems(device_data, name):
+    """Return the problems of lazily loaded commands.
+
+    Every mode is decoded and compiled into a throwaway table of its own,
+    so the whole tree is never held at once.
+    """
+    commands = device_data['commands']
+    modes = device_data['operationModes']
+    nodes = itertools.chain(
+        ((mode, node) for mode, node in commands.iter_decoded() if mode in modes),
+        ((mode, None) for mode in modes if mode not in commands))
+    problems = []
+
+    for mode, node in nodes:
+        table = CommandTable(dict(device_data, commands={mode: node}), name)
+        problems.extend(table.compile([mode]))
+    return problems
+
+
+def compile_commands(device_data, name):
+    """Return the CommandTable of a JSON climate device and its problems.
+
+    Fully parsed trees and sidecars are compiled straight away, lazily
+    loaded commands are left to be compiled one mode at a time on use.
+    Their problems are those kept under PROBLEMS_KEY, if any.
+    """
+    commands = device_data['commands']
+
+    if isinstance(commands, SidecarCommands):
+        table = SidecarCommandTable(device_data, name)
+    else:
+        table = CommandTable(device_data, name)
+        if not isinstance(commands, dict):
+            problems = device_data.get(PROBLEMS_KEY)
+            if problems is None:
+                problems = _lazy_problems(device_data, name)
+            return table, problems
+
+    return table, table.compile()
@@ -1,22 +1,33 @@
 from abc import ABC, abstractmethod
-from base64 import b64encode
+import aiohttp
+import asyncio
+from base64 import b64decode, b64encode
 import binascii
-import requests
+from collections import OrderedDict
+import functools
 import logging
 import json
+import threading
+import weakref
+import time
 import circa
 
 from homeassistant.const import ATTR_ENTITY_ID
-from . import Helper
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from . import Helper, broadlink_udp, protocols
 
 _LOGGER = logging.getLogger(__name__)
 
 BROADLINK_CONTROLLER = 'Broadlink'
+BROADLINK_UDP_CONTROLLER = 'BroadlinkUDP'
 XIAOMI_CONTROLLER = 'Xiaomi'
 MQTT_CONTROLLER = 'MQTT'
 LOOKIN_CONTROLLER = 'LOOKin'
 ESPHOME_CONTROLLER = 'ESPHome'
 
+FANOUT_ALL = 'all'
+FANOUT_FIRST = 'first'
+
 ENC_BASE64 = 'Base64'
 ENC_HEX = 'Hex'
 ENC_PRONTO = 'Pronto'
@@ -31,24 +42,452 @@ CIRCA_ENCODING_MAP = {
     ENC_RAW: "rawpm",
 }
 
-def get_controller(hass, controller, encoding, controller_data, delay):
-    """Return a controller compatible with the specification provided."""
+# Number of converted command strings kept by the conversion cache.
+CONVERSION_CACHE_SIZE = 1024
+# Conversions of commands at least this long run in the executor.
+OFFLOAD_MIN_LENGTH = 512
+# Maximum number of conversions running in the executor at once.
+OFFLOAD_MAX_CONCURRENCY = 2
+# Minimum time in seconds between two transmissions of the same emitter.
+EMITTER_PACING = 0.1
+# Identical commands of a batch sent with fold, with at most this many
+# seconds of silence between them, are folded into one transmission using the
+# repeat support of the code format.
+REPEAT_MAX_DELAY = 0.1
+# Default maximum seconds between two commands of a batch.
+DEFAULT_DELAY = 0.5
+# Default seconds left between two commands of a batch on top of the airtime
+# of the first one.
+DEFAULT_PACING_GUARD = 0.1
+# Seconds to wait for a LOOKin device to answer a command.
+LOOKIN_TIMEOUT = 5
+# Maximum number of requests in flight to one LOOKin device.
+LOOKIN_MAX_CONCURRENCY = 2
+# Length in seconds of one Broadlink pulse unit.
+BROADLINK_TICK = 269 / 8192 / 1000
+# Length in seconds of one Pronto frequency word unit.
+PRONTO_CLOCK = 0.241246e-6
+
+def _convert(input_encoding, output_encoding, command):
+    """Convert a command between two encodings with circa."""
+    if input_encoding == ENC_GENERIC:
+        code = circa.from_generic(command)
+    else:
+        input_format = CIRCA_ENCODING_MAP[input_encoding]
+        code = circa.find_format(input_format).from_string(input_format, command)
+
+    output_type = circa.find_format(CIRCA_ENCODING_MAP[output_encoding])
+    _, _, command = output_type.from_code(code).to_string_parts()
+    return command
+
+
+class _ConversionCache():
+    """A thread safe LRU of converted command strings."""
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def get_stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'max_size': self._max_size,
+        }
+
+# Shared by every controller, keyed by (input encoding, output encoding,
+# command string).
+_conversion_cache = _ConversionCache(CONVERSION_CACHE_SIZE)
+# Optional ConversionStore consulted before running circa.
+_conversion_store = None
+_offload_semaphore = asyncio.Semaphore(OFFLOAD_MAX_CONCURRENCY)
+
+def set_conversion_store(store):
+    """Use a persistent store for conversions missing from the cache."""
+    global _conversion_store
+    _conversion_store = store
+
+async def async_offload_conversion(hass, target, *args):
+    """Run a conversion in the executor, bounded by OFFLOAD_MAX_CONCURRENCY."""
+    async with _offload_semaphore:
+        return await hass.async_add_executor_job(target, *args)
+
+def _is_converted(input_encoding, output_encoding, command):
+    """Return True if converting command only needs a cache lookup."""
+    if (input_encoding, output_encoding, command) in _conversion_cache:
+        return True
+    store = _conversion_store
+    return store is not None and store.contains(input_encoding, output_encoding, command)
+
+def _convert_string(input_encoding, output_encoding, command):
+    """Convert a command string through the caches."""
+    key = (input_encoding, output_encoding, command)
+    converted = _conversion_cache.get(key)
+    if converted is not None:
+        return converted
+
+    store = _conversion_store
+    if store is not None:
+        converted = store.get(input_encoding, output_encoding, command)
+
+    if converted is None:
+        converted = _convert(input_encoding, output_encoding, command)
+        if store is not None:
+            store.put(input_encoding, output_encoding, command, converted)
+
+    _conversion_cache.put(key, converted)
+    return converted
+
+class EmitterScheduler():
+    """Sends the commands of one physical emitter one at a time.
+
+    Commands are sent in the order they were queued, at least `pacing`
+    seconds apart, so IR bursts from different entities sharing an emitter
+    never overlap. Different emitters have their own scheduler and run in
+    parallel.
+    """
+    def __init__(self, name, pacing):
+        self.name = name
+        self._pacing = pacing
+        self._lock = asyncio.Lock()
+        self._ready_at = 0
+        self.depth = 0
+        self.max_depth = 0
+        self.sends = 0
+        self.last_wait = 0
+        self.max_wait = 0
+        self._total_wait = 0
+
+    async def run(self, target, *args):
+        """Wait for the emitter, then await target(*args)."""
+        queued_at = time.monotonic()
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+
+        try:
+            async with self._lock:
+                delay = self._ready_at - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                wait = time.monotonic() - queued_at
+                self.sends += 1
+                self.last_wait = wait
+                self.max_wait = max(self.max_wait, wait)
+                self._total_wait += wait
+
+                try:
+                    return await target(*args)
+                finally:
+                    self._ready_at = time.monotonic() + self._pacing
+        finally:
+            self.depth -= 1
+
+    def get_stats(self):
+        """Return the queue depth and wait times of the emitter."""
+        return {
+            'queue_depth': self.depth,
+            'max_queue_depth': self.max_depth,
+            'sends': self.sends,
+            'last_wait': round(self.last_wait, 3),
+            'max_wait': round(self.max_wait, 3),
+            'average_wait': round(self._total_wait / self.sends, 3) if self.sends else 0,
+        }
+
+# Schedulers keyed by (controller type, controller_data).
+_schedulers = {}
+
+def get_scheduler(controller, controller_data):
+    """Return the scheduler of the emitter behind controller_data."""
+    key = (controller, controller_data)
+    scheduler = _schedulers.get(key)
+
+    if scheduler is None:
+        scheduler = EmitterScheduler(f"{controller} {controller_data}", EMITTER_PACING)
+        _schedulers[key] = scheduler
+
+    return scheduler
+
+class LookinHost():
+    """Request limit and counters of one LOOKin device."""
+    def __init__(self, host, max_concurrency):
+        self.host = host
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.requests = 0
+        self.errors = 0
+        self.last_latency = 0
+        self.max_latency = 0
+        self._total_latency = 0
+
+    def record(self, latency, error=False):
+        """Count a finished request."""
+        self.requests += 1
+        self.errors += error
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self._total_latency += latency
+
+    def get_stats(self):
+        """Return the request, error and latency counters of the device."""
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'last_latency': round(self.last_latency, 3),
+            'max_latency': round(self.max_latency, 3),
+            'average_latency': round(self._total_latency / self.requests, 3) if self.requests else 0,
+        }
+
+# LOOKin devices keyed by host.
+_lookin_hosts = {}
+_lookin_timeout = aiohttp.ClientTimeout(total=LOOKIN_TIMEOUT)
+_lookin_max_concurrency = LOOKIN_MAX_CONCURRENCY
+
+def set_lookin_options(timeout, max_concurrency):
+    """Set the request timeout and concurrency limit of LOOKin devices."""
+    global _lookin_timeout, _lookin_max_concurrency
+    _lookin_timeout = aiohttp.ClientTimeout(total=timeout)
+    _lookin_max_concurrency = max_concurrency
+    _lookin_hosts.clear()
+
+def get_lookin_host(host):
+    """Return the LookinHost of a device."""
+    lookin_host = _lookin_hosts.get(host)
+
+    if lookin_host is None:
+        lookin_host = LookinHost(host, _lookin_max_concurrency)
+        _lookin_hosts[host] = lookin_host
+
+    return lookin_host
+
+def get_stats():
+    """Return statistics of the controller layer."""
+    stats = {
+        'controllers': len(_controllers),
+        'conversion_cache': _conversion_cache.get_stats(),
+        'emitters': {
+            scheduler.name: scheduler.get_stats()
+            for scheduler in _schedulers.values()
+        },
+    }
+
+    if _fanout_targets:
+        stats['fanout'] = {
+            target.name: target.get_stats()
+            for target in _fanout_targets.values()
+        }
+
+    if _lookin_hosts:
+        stats['lookin'] = {
+            host: lookin_host.get_stats()
+            for host, lookin_host in _lookin_hosts.items()
+        }
+
+    info = airtime.cache_info()
+    stats['airtime_cache'] = {
+        'hits': info.hits,
+        'misses': info.misses,
+        'size': info.currsize,
+        'max_size': info.maxsize,
+    }
+
+    if _conversion_store is not None:
+        stats['persistent_conversion_cache'] = _conversion_store.get_stats()
+    return stats
+
+def _broadlink_airtime(packet):
+    """Return the seconds a Broadlink packet is on air, repeats included."""
+    length = int.from_bytes(packet[2:4], 'little')
+    pulses = packet[4:4 + length]
+    ticks = 0
+    i = 0
+
+    while i < len(pulses):
+        if pulses[i] == 0:
+            ticks += int.from_bytes(pulses[i + 1:i + 3], 'big')
+            i += 3
+        else:
+            ticks += pulses[i]
+            i += 1
+
+    return ticks * BROADLINK_TICK * (packet[1] + 1)
+
+@functools.lru_cache(maxsize=CONVERSION_CACHE_SIZE)
+def raw_pulses(command):
+    """Return the pulse lengths of a Raw command as a tuple of ints."""
+    return tuple(int(pulse) for pulse in command.split(','))
+
+@functools.lru_cache(maxsize=CONVERSION_CACHE_SIZE)
+def airtime(encoding, command):
+    """Return the seconds a converted command is on air, or None if unknown."""
+    try:
+        if encoding == ENC_BASE64:
+            return _broadlink_airtime(b64decode(command))
+        if encoding == ENC_HEX:
+            return _broadlink_airtime(bytes.fromhex(command))
+        if encoding == ENC_RAW:
+            return sum(abs(pulse) for pulse in raw_pulses(command)) / 1e6
+        if encoding == ENC_PRONTO:
+            words = [int(word, 16) for word in command.split()]
+            if words[0] == 0:
+                return sum(words[4:]) * words[1] * PRONTO_CLOCK
+    except (ValueError, IndexError, binascii.Error):
+        pass
+
+    return None
+
+def _group_repeats(commands):
+    """Yield (command, count) for each run of identical commands."""
+    previous, count = None, 0
+    for command in commands:
+        if count and command == previous:
+            count += 1
+            continue
+        if count:
+            yield previous, count
+        previous, count = command, 1
+    if count:
+        yield previous, count
+
+def broadlink_repeat(command, count):
+    """Return Base64 Broadlink packets sending command count times.
+
+    Byte 1 of a Broadlink packet is the number of extra times the device
+    replays it. Returns a list, as counts above 256 transmissions need more
+    than one packet.
+    """
+    packet = bytearray(b64decode(command))
+    times = (packet[1] + 1) * count
+    packets = []
+
+    while times > 0:
+        packet[1] = min(times, 256) - 1
+        packets.append(b64encode(packet).decode())
+        times -= packet[1] + 1
+
+    return packets
+
+@functools.lru_cache(maxsize=CONVERSION_CACHE_SIZE)
+def broadlink_packet(command):
+    """Return the packet bytes of a Base64 Broadlink command."""
+    return memoryview(b64decode(command))
+
+def pronto_repeat(command):
+    """Return a learned Pronto code whose whole signal is a repeat burst.
+
+    Players repeating the repeat burst of such a code transmit the full
+    signal each time. Returns None for codes that are not learned ones.
+    """
+    words = command.split()
+    if len(words) < 4 or words[0] != '0000':
+        return None
+
+    pairs = int(words[2], 16) + int(words[3], 16)
+    return ' '.join(words[:2] + ['0000', f"{pairs:04X}"] + words[4:])
+
+# Controllers in use, keyed by (controller type, input encoding,
+# controller_data, protocol payloads). Entities sending through the same
+# emitter with the same codes share one controller.
+_controllers = weakref.WeakValueDictionary()
+
+class FanoutTarget():
+    """Latency and error counters of one emitter of fanned out commands."""
+    def __init__(self, name):
+        self.name = name
+        self.sends = 0
+        self.errors = 0
+        self.last_latency = 0
+        self.max_latency = 0
+        self._total_latency = 0
+
+    def record(self, latency, error=False):
+        """Count a finished send."""
+        self.sends += 1
+        self.errors += error
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self._total_latency += latency
+
+    def get_stats(self):
+        """Return the send, error and latency counters of the emitter."""
+        return {
+            'sends': self.sends,
+            'errors': self.errors,
+            'last_latency': round(self.last_latency, 3),
+            'max_latency': round(self.max_latency, 3),
+            'average_latency': round(self._total_latency / self.sends, 3) if self.sends else 0,
+        }
+
+# Emitters used by a MultiController, keyed by (controller type, controller_data).
+_fanout_targets = {}
+
+def get_controller(hass, controller, encoding, controller_data,
+                   protocol_payloads=False, fanout_mode=FANOUT_ALL):
+    """Return a controller compatible with the specification provided.
+
+    The controller is shared with every other entity using the same one, the
+    delay and pacing guard of each entity are given with every send. A list
+    of controller_data returns a MultiController sending to all of them.
+    """
+    if isinstance(controller_data, list):
+        if len(controller_data) > 1:
+            return MultiController(hass, [
+                get_controller(hass, controller, encoding, data, protocol_payloads)
+                for data in controller_data
+            ], fanout_mode)
+        controller_data = controller_data[0]
+
+    key = (controller, encoding, controller_data, protocol_payloads)
+    instance = _controllers.get(key)
+    if instance is not None:
+        return instance
+
     controllers = {
         BROADLINK_CONTROLLER: BroadlinkController,
+        BROADLINK_UDP_CONTROLLER: BroadlinkUDPController,
         XIAOMI_CONTROLLER: XiaomiController,
         MQTT_CONTROLLER: MQTTController,
         LOOKIN_CONTROLLER: LookinController,
         ESPHOME_CONTROLLER: ESPHomeController
     }
     try:
-        return controllers[controller](hass, controller, encoding, controller_data, delay)
+        controller_class = controllers[controller]
     except KeyError:
         raise Exception("The controller is not supported.")
 
+    instance = controller_class(
+        hass, controller, encoding, controller_data, protocol_payloads)
+    _controllers[key] = instance
+    return instance
+
 
 class AbstractController(ABC):
     """Representation of a controller."""
-    def __init__(self, hass, controller, encoding, controller_data, delay):
+    def __init__(self, hass, controller, encoding, controller_data,
+                 protocol_payloads=False):
         self.hass = hass
         self._controller = controller
         self._input_encoding = encoding
@@ -65,29 +504,239 @@ class AbstractController(ABC):
 
         self._circa_type = circa.find_format(CIRCA_ENCODING_MAP[self._encoding])
         self._controller_data = controller_data
-        self._delay = delay
+        self._protocol_payloads = protocol_payloads
+        self._scheduler = get_scheduler(controller, controller_data)
 
-    async def send(self, command):
-        """Send a command to the controller."""
-        _LOGGER.debug(f"Original command: {command!r}")
+    @property
+    def encoding(self):
+        """Return the encoding commands are sent in."""
+        return self._encoding
+
+    def _needs_conversion(self, command):
+        return (isinstance(command, circa.IRCode) or
+                self._input_encoding == ENC_GENERIC or
+                self._input_encoding != self._encoding or
+                self._encoding == ENC_RAW) # Always normalize raw codes
+
+    def convert(self, command):
+        """Convert a command to the encoding accepted by the controller."""
+        if isinstance(command, list):
+            return [self.convert(code) for code in command]
 
         if isinstance(command, circa.IRCode):
             _, _, command = self._circa_type.from_code(command).to_string_parts()
-        elif self._input_encoding == ENC_GENERIC:
-            _, _, command = self._circa_type.from_code(circa.from_generic(command)).to_string_parts()
-        elif self._input_encoding != self._encoding or self._encoding == ENC_RAW: # Always normalize raw codes
-            code = self._circa_input_type.from_string(CIRCA_ENCODING_MAP[self._input_encoding], command)
-            _, _, command = self._circa_type.from_code(code).to_string_parts()
+        elif self._needs_conversion(command):
+            if isinstance(command, str):
+                command = _convert_string(self._input_encoding, self._encoding, command)
+            else:
+                command = _convert(self._input_encoding, self._encoding, command)
 
-        _LOGGER.debug(f"--> Converted command: {command!r}")
+        return command
+
+    async def async_convert(self, command):
+        """Convert a command, in the executor if that is expensive.
+
+        Cached and short commands are converted inline, anything else runs
+        in the executor, OFFLOAD_MAX_CONCURRENCY conversions at a time.
+        """
+        if isinstance(command, list):
+            return [await self.async_convert(code) for code in command]
 
-        return await self._send(command)
+        if not self._needs_conversion(command) or (
+                isinstance(command, str) and (
+                    len(command) < OFFLOAD_MIN_LENGTH or
+                    _is_converted(self._input_encoding, self._encoding, command))):
+            return self.convert(command)
+
+        return await async_offload_conversion(self.hass, self.convert, command)
+
+    async def send(self, command, delay=DEFAULT_DELAY):
+        """Send a command to the controller.
+
+        `delay` separates the codes of commands made of a list of codes.
+        """
+        _LOGGER.debug(f"Original command: {command!r}")
+        return await self.send_converted(await self.async_convert(command), delay)
+
+    async def send_converted(self, command, delay=DEFAULT_DELAY):
+        """Send a command already converted by convert()."""
+        _LOGGER.debug(f"--> Converted command: {command!r}")
+        if isinstance(command, list):
+            return await self._scheduler.run(self._send_batch, command, float(delay))
+        return await self._scheduler.run(self._send, command)
+
+    def _batch_delay(self, commands, delay, guard):
+        """Return the gap to leave between the commands of a batch.
+
+        That is the airtime of the longest command plus the guard time, but
+        never more than `delay`, which is also used when an airtime is unknown
+        or the guard is None.
+        """
+        if guard is None:
+            return delay
+
+        gap = 0
+        for command in commands[:-1]:
+            duration = airtime(self._encoding, command)
+            if duration is None:
+                return delay
+            gap = max(gap, duration + guard)
+
+        return min(gap, delay)
+
+    def _foldable(self, command, delay):
+        """Return True if repeats of command may be sent back to back."""
+        return delay <= (airtime(self._encoding, command) or 0) + REPEAT_MAX_DELAY
+
+    async def send_batch(self, commands, delay=DEFAULT_DELAY,
+                         guard=DEFAULT_PACING_GUARD, fold=False):
+        """Send several commands in order, at most `delay` seconds apart.
+
+        The commands are delivered in a single call where the controller
+        supports it, and without other commands of the emitter in between.
+        A command made of a list of codes is sent as with send(), with
+        `delay` between its codes. With fold, runs of identical commands
+        (step presses) may be sent as one repeated transmission.
+        """
+        converted = [await self.async_convert(command) for command in commands]
+        return await self.send_converted_batch(converted, delay, guard, fold)
+
+    async def send_converted_batch(self, commands, delay=DEFAULT_DELAY,
+                                   guard=DEFAULT_PACING_GUARD, fold=False):
+        """Send several commands already converted by convert()."""
+        _LOGGER.debug(f"--> Converted commands: {commands!r}")
+        delay = float(delay)
+        parts = self._batch_parts(commands, delay, guard, fold)
+        return await self._scheduler.run(self._send_parts, parts, delay)
+
+    def _batch_parts(self, commands, delay, guard, fold):
+        """Split a batch into the (codes, gap, fold) parts sent in order.
+
+        Runs of single codes are paced by their airtime, the codes of a list
+        command keep `delay` between them and are never folded.
+        """
+        parts = []
+        run = []
+
+        for command in commands:
+            if isinstance(command, list):
+                if run:
+                    parts.append((run, self._batch_delay(run, delay, guard), fold))
+                    run = []
+                parts.append((command, delay, False))
+            else:
+                run.append(command)
+
+        if run:
+            parts.append((run, self._batch_delay(run, delay, guard), fold))
+        return parts
+
+    async def _send_parts(self, parts, delay):
+        """Send the parts of a batch, `delay` seconds apart."""
+        for i, (commands, gap, fold) in enumerate(parts):
+            if i:
+                await asyncio.sleep(delay)
+            await self._send_batch(commands, gap, fold)
 
     @abstractmethod
     async def _send(self, command):
         """Send a formatted command to the controller."""
         pass
 
+    async def _send_batch(self, commands, delay, fold=False):
+        """Send formatted commands, one call per command."""
+        for i, command in enumerate(commands):
+            if i:
+                await asyncio.sleep(delay)
+            await self._send(command)
+
+
+class MultiController():
+    """Sends the commands of one entity through several emitters at once.
+
+    Commands are converted once, then sent to every controller in parallel.
+    With FANOUT_FIRST a send completes as soon as one emitter succeeded, the
+    others finishing in the background; with FANOUT_ALL it completes when
+    all of them did, and fails if any of them failed.
+    """
+    def __init__(self, hass, controllers, mode=FANOUT_ALL):
+        self.hass = hass
+        self._controllers = controllers
+        self._mode = mode
+        self._targets = []
+
+        for controller in controllers:
+            key = (controller._controller, controller._controller_data)
+            target = _fanout_targets.get(key)
+            if target is None:
+                target = FanoutTarget(f"{controller._controller} {controller._controller_data}")
+                _fanout_targets[key] = target
+            self._targets.append(target)
+
+    @property
+    def encoding(self):
+        """Return the encoding commands are sent in."""
+        return self._controllers[0].encoding
+
+    def convert(self, command):
+        """Convert a command to the encoding accepted by the controllers."""
+        return self._controllers[0].convert(command)
+
+    async def async_convert(self, command):
+        """Convert a command, in the executor if that is expensive."""
+        return await self._controllers[0].async_convert(command)
+
+    async def _send_to(self, controller, target, method, *args):
+        """Send through one controller, returning the error if it failed."""
+        start = time.monotonic()
+        try:
+            await getattr(controller, method)(*args)
+        except Exception as e:
+            target.record(time.monotonic() - start, True)
+            _LOGGER.warning(f"Sending to {target.name} failed: {e!r}")
+            return e
+        target.record(time.monotonic() - start)
+        return None
+
+    async def _fan_out(self, method, *args):
+        tasks = [
+            self.hass.async_create_task(self._send_to(controller, target, method, *args))
+            for controller, target in zip(self._controllers, self._targets)
+        ]
+
+        if self._mode == FANOUT_FIRST:
+            errors = []
+            for task in asyncio.as_completed(tasks):
+                error = await task
+                if error is None:
+                    return
+                errors.append(error)
+            raise errors[0]
+
+        errors = [error for error in await asyncio.gather(*tasks) if error is not None]
+        if errors:
+            raise errors[0]
+
+    async def send(self, command, delay=DEFAULT_DELAY):
+        """Send a command through every controller."""
+        _LOGGER.debug(f"Original command: {command!r}")
+        return await self.send_converted(await self.async_convert(command), delay)
+
+    async def send_converted(self, command, delay=DEFAULT_DELAY):
+        """Send a command already converted by convert()."""
+        await self._fan_out('send_converted', command, delay)
+
+    async def send_batch(self, commands, delay=DEFAULT_DELAY,
+                         guard=DEFAULT_PACING_GUARD, fold=False):
+        """Send several commands in order through every controller."""
+        converted = [await self.async_convert(command) for command in commands]
+        return await self.send_converted_batch(converted, delay, guard, fold)
+
+    async def send_converted_batch(self, commands, delay=DEFAULT_DELAY,
+                                   guard=DEFAULT_PACING_GUARD, fold=False):
+        """Send several commands already converted by convert()."""
+        await self._fan_out('send_converted_batch', commands, delay, guard, fold)
+
 
 class BroadlinkController(AbstractController):
     """Controls a Broadlink device."""
@@ -95,24 +744,50 @@ class BroadlinkController(AbstractController):
 
     async def _send(self, command):
         """Send a command."""
-        commands = []
-
-        if not isinstance(command, list): 
-            command = [command]
-
-        for _command in command:
-            commands.append('b64:' + _command)
-
+        await self._send_batch([command], 0)
+
+    def _fold(self, commands, delay, fold):
+        """Return commands with runs of repeats folded into one packet."""
+        if not fold:
+            return commands
+
+        folded = []
+        for command, count in _group_repeats(commands):
+            if count > 1 and self._foldable(command, delay):
+                folded.extend(broadlink_repeat(command, count))
+            else:
+                folded.extend([command] * count)
+        return folded
+
+    async def _send_batch(self, commands, delay, fold=False):
+        """Send commands in one service call."""
         service_data = {
             ATTR_ENTITY_ID: self._controller_data,
-            'command':  commands,
-            'delay_secs': self._delay
+            'command':  ['b64:' + command for command in self._fold(commands, delay, fold)],
+            'delay_secs': delay
         }
 
         await self.hass.services.async_call(
             'remote', 'send_command', service_data)
 
 
+class BroadlinkUDPController(BroadlinkController):
+    """Controls a Broadlink device over UDP, without the Broadlink integration.
+
+    controller_data is the host of the device.
+    """
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._device = broadlink_udp.get_device(self._controller_data)
+
+    async def _send_batch(self, commands, delay, fold=False):
+        """Send commands straight to the device."""
+        for i, command in enumerate(self._fold(commands, delay, fold)):
+            if i:
+                await asyncio.sleep(delay)
+            await self._device.send_data(broadlink_packet(command))
+
+
 class XiaomiController(AbstractController):
     """Controls a Xiaomi device."""
     ENCODINGS = [ENC_PRONTO, ENC_XIAOMI]
@@ -127,6 +802,34 @@ class XiaomiController(AbstractController):
         await self.hass.services.async_call(
             'remote', 'send_command', service_data)
 
+    async def _send_batch(self, commands, delay, fold=False):
+        """Send commands in one service call."""
+        prefix = self._encoding.lower().replace("xiaomi", "raw") + ':'
+        payloads = []
+
+        for command, count in _group_repeats(commands):
+            # python-miio plays "pronto:<code>:<repeats>" in one go. The
+            # count is of extra repeats, and as pronto_repeat() leaves no
+            # intro, miio plays the repeat burst once more on its own.
+            repeated = None
+            if (fold and count > 1 and self._encoding == ENC_PRONTO and
+                    self._foldable(command, delay)):
+                repeated = pronto_repeat(command)
+
+            if repeated is not None:
+                payloads.append(f"{prefix}{repeated}:{count - 1}")
+            else:
+                payloads.extend([prefix + command] * count)
+
+        service_data = {
+            ATTR_ENTITY_ID: self._controller_data,
+            'command':  payloads,
+            'delay_secs': delay
+        }
+
+        await self.hass.services.async_call(
+            'remote', 'send_command', service_data)
+
 
 class MQTTController(AbstractController):
     """Controls a MQTT device."""
@@ -134,9 +837,15 @@ class MQTTController(AbstractController):
 
     async def _send(self, command):
         """Send a command."""
+        payload = command
+        if self._protocol_payloads:
+            code = protocols.decode(raw_pulses(command))
+            if code is not None:
+                payload = json.dumps(protocols.tasmota_payload(code))
+
         service_data = {
             'topic': self._controller_data,
-            'payload': command
+            'payload': payload
         }
 
         await self.hass.services.async_call(
@@ -152,7 +861,19 @@ class LookinController(AbstractController):
         encoding = self._encoding.lower().replace('pronto', 'prontohex')
         url = f"http://{self._controller_data}/commands/ir/" \
                 f"{encoding}/{command.replace(",", " ")}"
-        await self.hass.async_add_executor_job(requests.get, url)
+        # The shared session keeps the connection to the device alive.
+        session = async_get_clientsession(self.hass)
+        lookin_host = get_lookin_host(self._controller_data)
+
+        async with lookin_host.semaphore:
+            start = time.monotonic()
+            try:
+                async with session.get(url, timeout=_lookin_timeout) as response:
+                    response.raise_for_status()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                lookin_host.record(time.monotonic() - start, True)
+                raise
+            lookin_host.record(time.monotonic() - start)
 
 
 class ESPHomeController(AbstractController):
@@ -161,7 +882,18 @@ class ESPHomeController(AbstractController):
 
     async def _send(self, command):
         """Send a command."""
-        service_data = {'command': json.loads(f"[{command}]")}
+        if self._protocol_payloads:
+            code = protocols.decode(raw_pulses(command))
+            data = protocols.esphome_data(code) if code else None
+            service = f"{self._controller_data}_{code.protocol.lower()}" if data else None
+            if service and self.hass.services.has_service('esphome', service):
+                try:
+                    await self.hass.services.async_call('esphome', service, data)
+                    return
+                except Exception as e:
+                    _LOGGER.warning(f"esphome.{service} failed, sending the raw code: {e!r}")
+
+        service_data = {'command': list(raw_pulses(command))}
 
         await self.hass.services.async_call(
             'esphome', self._controller_data, service_data)
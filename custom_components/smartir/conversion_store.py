@@ -0,0 +1,144 @@
+"""Persistent store of converted commands.
+
+Keeps the output of circa conversions across restarts in an SQLite
+database, keyed by (input encoding, output encoding, hash of the command).
+The whole store is bounded and read into memory at startup, so lookups
+never touch the disk. New and used entries are written back in batches
+from the executor, evicting the least recently used rows above the size
+limit.
+"""
+from collections import OrderedDict
+from datetime import timedelta
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+from homeassistant.helpers.event import async_track_time_interval
+
+_LOGGER = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = timedelta(seconds=30)
+
+
+class ConversionStore():
+    """An LRU bounded, SQLite backed conversion cache."""
+    def __init__(self, hass, path, max_size):
+        self.hass = hass
+        self._path = path
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(input_encoding, output_encoding, command):
+        digest = hashlib.sha1(command.encode()).hexdigest()
+        return (input_encoding, output_encoding, digest)
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        connection = sqlite3.connect(self._path)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS conversions ("
+            "input_encoding TEXT, output_encoding TEXT, code_hash TEXT, "
+            "payload TEXT, last_used REAL, "
+            "PRIMARY KEY (input_encoding, output_encoding, code_hash))")
+        return connection
+
+    def _load(self):
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT input_encoding, output_encoding, code_hash, payload "
+                "FROM conversions ORDER BY last_used DESC LIMIT ?",
+                (self._max_size,)).fetchall()
+        finally:
+            connection.close()
+
+        with self._lock:
+            for input_encoding, output_encoding, code_hash, payload in reversed(rows):
+                self._entries[(input_encoding, output_encoding, code_hash)] = payload
+
+    def _flush(self, pending):
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT INTO conversions VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (input_encoding, output_encoding, code_hash) "
+                    "DO UPDATE SET last_used = excluded.last_used",
+                    [key + entry for key, entry in pending.items()])
+                connection.execute(
+                    "DELETE FROM conversions WHERE rowid NOT IN ("
+                    "SELECT rowid FROM conversions ORDER BY last_used DESC LIMIT ?)",
+                    (self._max_size,))
+        finally:
+            connection.close()
+
+    async def async_load(self):
+        """Read the store and start writing changes back periodically."""
+        await self.hass.async_add_executor_job(self._load)
+        _LOGGER.debug(f"Loaded {len(self._entries)} converted commands from {self._path}")
+
+        async_track_time_interval(self.hass, self._async_flush, FLUSH_INTERVAL)
+        self.hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, self._async_flush)
+
+    async def _async_flush(self, *args):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        if not pending:
+            return
+
+        try:
+            await self.hass.async_add_executor_job(self._flush, pending)
+        except sqlite3.Error as e:
+            _LOGGER.warning(f"Unable to write converted commands to {self._path}: {e}")
+
+    def contains(self, input_encoding, output_encoding, command):
+        """Return True if the conversion of command is stored."""
+        key = self._key(input_encoding, output_encoding, command)
+        with self._lock:
+            return key in self._entries
+
+    def get(self, input_encoding, output_encoding, command):
+        """Return the stored conversion of command, or None."""
+        key = self._key(input_encoding, output_encoding, command)
+
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+            self._pending[key] = (payload, time.time())
+            return payload
+
+    def put(self, input_encoding, output_encoding, command, payload):
+        """Store the conversion of command."""
+        key = self._key(input_encoding, output_encoding, command)
+
+        with self._lock:
+            self._entries[key] = payload
+            self._entries.move_to_end(key)
+            self._pending[key] = (payload, time.time())
+
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def get_stats(self):
+        """Return the hit/miss counters and size of the store."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'max_size': self._max_size,
+        }
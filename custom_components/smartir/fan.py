@@ -19,8 +19,8 @@ from homeassistant.util.percentage import (
     ordered_list_item_to_percentage,
     percentage_to_ordered_list_item
 )
-from . import COMPONENT_ABS_DIR, Helper, async_get_device_data, CONF_DEVICE_CODE
-from .controller import get_controller
+from . import COMPONENT_ABS_DIR, Helper, async_get_device_data, async_release_device_data, static_attributes, STATIC_ATTRIBUTES, CONF_DEVICE_CODE
+from .controller import FANOUT_ALL, FANOUT_FIRST, get_controller
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -29,8 +29,10 @@ DEFAULT_DELAY = 0.5
 
 CONF_UNIQUE_ID = 'unique_id'
 CONF_CONTROLLER_DATA = "controller_data"
+CONF_FANOUT_MODE = "fanout_mode"
 CONF_CONTROLLER_TYPE = "controller_type"
 CONF_DELAY = "delay"
+CONF_PROTOCOL_PAYLOADS = "protocol_payloads"
 CONF_POWER_SENSOR = 'power_sensor'
 
 SPEED_OFF = "off"
@@ -40,35 +42,47 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
     vol.Optional(CONF_NAME, default=DEFAULT_NAME): cv.string,
     vol.Required(CONF_DEVICE_CODE): cv.positive_int,
     vol.Optional(CONF_CONTROLLER_TYPE): cv.string,
-    vol.Required(CONF_CONTROLLER_DATA): cv.string,
+    vol.Required(CONF_CONTROLLER_DATA): vol.Any(
+        cv.string, vol.All([cv.string], vol.Length(min=1))),
+    vol.Optional(CONF_FANOUT_MODE, default=FANOUT_ALL): vol.In(
+        [FANOUT_ALL, FANOUT_FIRST]),
     vol.Optional(CONF_DELAY, default=DEFAULT_DELAY): cv.string,
+    vol.Optional(CONF_PROTOCOL_PAYLOADS, default=False): cv.boolean,
     vol.Optional(CONF_POWER_SENSOR): cv.entity_id
 })
 
 async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up the IR Fan platform."""
-    device_data = await async_get_device_data('fan', config)
+    device_data = await async_get_device_data(hass, 'fan', config)
     if device_data is None:
         return
 
-    async_add_entities([SmartIRFan(
-        hass, config, device_data
-    )])
+    try:
+        entity = SmartIRFan(hass, config, device_data)
+    except Exception:
+        async_release_device_data('fan', config.get(CONF_DEVICE_CODE))
+        raise
+    async_add_entities([entity])
 
 class SmartIRFan(FanEntity, RestoreEntity):
+    _unrecorded_attributes = STATIC_ATTRIBUTES
+
     def __init__(self, hass, config, device_data):
         self.hass = hass
         self._unique_id = config.get(CONF_UNIQUE_ID)
         self._name = config.get(CONF_NAME)
         self._device_code = config.get(CONF_DEVICE_CODE)
         self._controller_data = config.get(CONF_CONTROLLER_DATA)
+        self._fanout_mode = config.get(CONF_FANOUT_MODE)
         self._delay = config.get(CONF_DELAY)
+        self._protocol_payloads = config.get(CONF_PROTOCOL_PAYLOADS)
         self._power_sensor = config.get(CONF_POWER_SENSOR)
 
         self._manufacturer = device_data['manufacturer']
         self._supported_models = device_data['supportedModels']
         self._default_controller = device_data.get('defaultController', None)
         self._commands_encoding = device_data['commandsEncoding']
+        self._static_attributes = static_attributes(self._device_code, device_data)
         self._speed_list = device_data['speed']
         self._commands = device_data['commands']
         
@@ -103,7 +117,8 @@ class SmartIRFan(FanEntity, RestoreEntity):
             self._controller_type,
             self._commands_encoding,
             self._controller_data,
-            self._delay)
+            self._protocol_payloads,
+            self._fanout_mode)
 
     async def async_added_to_hass(self):
         """Run when entity about to be added."""
@@ -128,6 +143,16 @@ class SmartIRFan(FanEntity, RestoreEntity):
                 async_track_state_change_event(self.hass, self._power_sensor, 
                                                self._async_power_sensor_changed)
 
+    def add_to_platform_abort(self):
+        """Release the shared device data of an entity never added."""
+        super().add_to_platform_abort()
+        async_release_device_data('fan', self._device_code)
+
+    async def async_will_remove_from_hass(self):
+        """Release the shared device data."""
+        await super().async_will_remove_from_hass()
+        async_release_device_data('fan', self._device_code)
+
     @property
     def unique_id(self):
         """Return a unique ID."""
@@ -183,12 +208,8 @@ class SmartIRFan(FanEntity, RestoreEntity):
     def extra_state_attributes(self):
         """Platform specific attributes."""
         return {
+            **self._static_attributes,
             'last_on_speed': self._last_on_speed,
-            'device_code': self._device_code,
-            'manufacturer': self._manufacturer,
-            'supported_models': self._supported_models,
-            'default_controller': self._default_controller,
-            'commands_encoding': self._commands_encoding,
         }
 
     async def async_set_percentage(self, percentage: int):
@@ -248,7 +269,7 @@ class SmartIRFan(FanEntity, RestoreEntity):
                 command = self._commands[direction][speed] 
 
             try:
-                await self._controller.send(command)
+                await self._controller.send(command, self._delay)
             except Exception as e:
                 _LOGGER.exception(e)
 
@@ -0,0 +1,160 @@
+"""Streaming loader for large device JSON files.
+
+The file is memory mapped and scanned for the boundaries of its top level
+members. The metadata keys are decoded straight away, while every entry of
+the "commands" object is only decoded from its own byte range the first
+time it is looked up. Setting up an entity therefore never holds the whole
+file as a string nor the full commands tree.
+"""
+from collections.abc import Mapping
+import json
+import mmap
+import re
+
+LAZY_MIN_SIZE = 256 * 1024
+
+_STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+_STRUCT = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{}]', re.S)
+_SCALAR = re.compile(rb'[^,}\]\s]+')
+_WS = re.compile(rb'\s*')
+
+_QUOTE = ord('"')
+_OPEN = (ord('{'), ord('['))
+_CLOSE = (ord('}'), ord(']'))
+
+
+def _skip_ws(buf, pos):
+    return _WS.match(buf, pos).end()
+
+
+def _value_end(buf, pos):
+    """Return the end offset of the JSON value starting at pos."""
+    if buf[pos] == _QUOTE:
+        match = _STRING.match(buf, pos)
+    elif buf[pos] in _OPEN:
+        depth = 0
+        for match in _STRUCT.finditer(buf, pos):
+            char = buf[match.start()]
+            if char in _OPEN:
+                depth += 1
+            elif char in _CLOSE:
+                depth -= 1
+                if depth == 0:
+                    return match.end()
+        match = None
+    else:
+        match = _SCALAR.match(buf, pos)
+
+    if match is None:
+        raise ValueError(f"Unterminated JSON value at offset {pos}")
+    return match.end()
+
+
+def _members(buf, pos):
+    """Return the (key, start, end) members of the object at pos.
+
+    The offset just past the closing brace is returned alongside.
+    """
+    if buf[pos] != _OPEN[0]:
+        raise ValueError(f"Expected a JSON object at offset {pos}")
+
+    members = []
+    pos = _skip_ws(buf, pos + 1)
+    if buf[pos] == _CLOSE[0]:
+        return members, pos + 1
+
+    while True:
+        match = _STRING.match(buf, pos)
+        if match is None:
+            raise ValueError(f"Expected a property name at offset {pos}")
+        key = json.loads(buf[match.start():match.end()])
+
+        pos = _skip_ws(buf, match.end())
+        if buf[pos] != ord(':'):
+            raise ValueError(f"Expected ':' at offset {pos}")
+        start = _skip_ws(buf, pos + 1)
+
+        if key == 'commands' and buf[start] == _OPEN[0]:
+            # Remember the spans of the commands entries instead of skipping
+            # over the whole object and scanning it a second time.
+            commands, end = _members(buf, start)
+            members.append((key, start, end, commands))
+        else:
+            end = _value_end(buf, start)
+            members.append((key, start, end, None))
+
+        pos = _skip_ws(buf, end)
+        if buf[pos] == ord(','):
+            pos = _skip_ws(buf, pos + 1)
+        elif buf[pos] == _CLOSE[0]:
+            return members, pos + 1
+        else:
+            raise ValueError(f"Expected ',' or '}}' at offset {pos}")
+
+
+def load(path):
+    """Return the device data of path with lazily decoded commands."""
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    pos = 3 if mm[:3] == b'\xef\xbb\xbf' else 0
+    members, _ = _members(mm, _skip_ws(mm, pos))
+    device_data = {}
+
+    for key, start, end, commands in members:
+        if commands is not None:
+            device_data[key] = LazyCommands(
+                mm, {name: (begin, stop) for name, begin, stop, _ in commands})
+        else:
+            device_data[key] = json.loads(mm[start:end])
+
+    return device_data
+
+
+class LazyCommands(Mapping):
+    """Read-only commands mapping decoding each entry on first access.
+
+    spans maps every key to the (start, end) byte range of its encoded
+    value in mm, decode turns such a range into the value.
+    """
+    def __init__(self, mm, spans, decode=json.loads):
+        self._mm = mm
+        self._spans = spans
+        self._decode = decode
+        self._values = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+
+        start, end = self._spans[key]
+        value = self._values[key] = self._decode(self._mm[start:end])
+
+        # Everything is decoded, the mapping is no longer needed.
+        if len(self._values) == len(self._spans):
+            self._mm = None
+
+        return value
+
+    def iter_decoded(self):
+        """Yield (key, value) pairs without keeping the decoded values.
+
+        Serialising the commands this way holds one entry at a time
+        instead of the whole tree.
+        """
+        for key, (start, end) in self._spans.items():
+            value = self._values.get(key)
+            if value is None:
+                value = self._decode(self._mm[start:end])
+            yield key, value
+
+    def __contains__(self, key):
+        return key in self._spans
+
+    def __iter__(self):
+        return iter(self._spans)
+
+    def __len__(self):
+        return len(self._spans)
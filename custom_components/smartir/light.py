@@ -22,19 +22,25 @@ from homeassistant.core import callback
 from homeassistant.helpers.event import async_track_state_change_event
 import homeassistant.helpers.config_validation as cv
 from homeassistant.helpers.restore_state import RestoreEntity
-from . import COMPONENT_ABS_DIR, Helper, async_get_device_data, CONF_DEVICE_CODE
-from .controller import get_controller
+from . import COMPONENT_ABS_DIR, Helper, async_get_device_data, async_release_device_data, static_attributes, STATIC_ATTRIBUTES, CONF_DEVICE_CODE
+from .controller import FANOUT_ALL, FANOUT_FIRST, get_controller
+from .step_planner import DEFAULT_RESYNC_THRESHOLD, DOWN, StepPlanner
 
 _LOGGER = logging.getLogger(__name__)
 
 DEFAULT_NAME = "SmartIR Light"
 DEFAULT_DELAY = 0.5
+DEFAULT_PACING_GUARD = 0.1
 
 CONF_UNIQUE_ID = "unique_id"
 CONF_CONTROLLER_DATA = "controller_data"
+CONF_FANOUT_MODE = "fanout_mode"
 CONF_CONTROLLER_TYPE = "controller_type"
 CONF_DELAY = "delay"
+CONF_PACING_GUARD = "pacing_guard"
+CONF_PROTOCOL_PAYLOADS = "protocol_payloads"
 CONF_POWER_SENSOR = "power_sensor"
+CONF_RESYNC_THRESHOLD = "resync_threshold"
 
 CMD_BRIGHTNESS_INCREASE = "brighten"
 CMD_BRIGHTNESS_DECREASE = "dim"
@@ -50,9 +56,15 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
         vol.Optional(CONF_NAME, default=DEFAULT_NAME): cv.string,
         vol.Required(CONF_DEVICE_CODE): cv.positive_int,
         vol.Optional(CONF_CONTROLLER_TYPE): cv.string,
-        vol.Required(CONF_CONTROLLER_DATA): cv.string,
+        vol.Required(CONF_CONTROLLER_DATA): vol.Any(
+            cv.string, vol.All([cv.string], vol.Length(min=1))),
+        vol.Optional(CONF_FANOUT_MODE, default=FANOUT_ALL): vol.In(
+            [FANOUT_ALL, FANOUT_FIRST]),
         vol.Optional(CONF_DELAY, default=DEFAULT_DELAY): cv.string,
+        vol.Optional(CONF_PACING_GUARD, default=DEFAULT_PACING_GUARD): cv.positive_float,
+        vol.Optional(CONF_PROTOCOL_PAYLOADS, default=False): cv.boolean,
         vol.Optional(CONF_POWER_SENSOR): cv.entity_id,
+        vol.Optional(CONF_RESYNC_THRESHOLD, default=DEFAULT_RESYNC_THRESHOLD): cv.positive_float,
     }
 )
 
@@ -64,47 +76,44 @@ async def async_setup_platform(
     discovery_info=None,
 ):
     """Set up the IR Light platform."""
-    device_data = await async_get_device_data('light', config)
+    device_data = await async_get_device_data(hass, 'light', config)
     if device_data is None:
         return
 
-    async_add_entities([SmartIRLight(hass, config, device_data)])
-
-
-# find the closest match in a sorted list
-def closest_match(value, list):
-    prev_val = None
-    for index, entry in enumerate(list):
-        if entry > (value or 0):
-            if prev_val is None:
-                return index
-            diff_lo = value - prev_val
-            diff_hi = entry - value
-            if diff_lo < diff_hi:
-                return index - 1
-            return index
-        prev_val = entry
-
-    return len(list) - 1
+    try:
+        entity = SmartIRLight(hass, config, device_data)
+    except Exception:
+        async_release_device_data('light', config.get(CONF_DEVICE_CODE))
+        raise
+    async_add_entities([entity])
 
 
 class SmartIRLight(LightEntity, RestoreEntity):
+    _unrecorded_attributes = STATIC_ATTRIBUTES
+
     def __init__(self, hass, config, device_data):
         self.hass = hass
         self._unique_id = config.get(CONF_UNIQUE_ID)
         self._name = config.get(CONF_NAME)
         self._device_code = config.get(CONF_DEVICE_CODE)
         self._controller_data = config.get(CONF_CONTROLLER_DATA)
+        self._fanout_mode = config.get(CONF_FANOUT_MODE)
         self._delay = config.get(CONF_DELAY)
+        self._pacing_guard = config.get(CONF_PACING_GUARD)
+        self._protocol_payloads = config.get(CONF_PROTOCOL_PAYLOADS)
         self._power_sensor = config.get(CONF_POWER_SENSOR)
+        resync_threshold = config.get(CONF_RESYNC_THRESHOLD)
 
         self._manufacturer = device_data["manufacturer"]
         self._supported_models = device_data["supportedModels"]
         self._default_controller = device_data.get('defaultController', None)
         self._commands_encoding = device_data["commandsEncoding"]
+        self._static_attributes = static_attributes(self._device_code, device_data)
         self._brightnesses = device_data["brightness"]
         self._colortemps = device_data["colorTemperature"]
         self._commands = device_data["commands"]
+        self._colortemp_planner = StepPlanner(self._colortemps, resync_threshold)
+        self._brightness_planner = StepPlanner(self._brightnesses, resync_threshold)
 
         self._controller_type = config.get(CONF_CONTROLLER_TYPE, self._default_controller)
 
@@ -147,7 +156,8 @@ class SmartIRLight(LightEntity, RestoreEntity):
             self._controller_type,
             self._commands_encoding,
             self._controller_data,
-            self._delay,
+            self._protocol_payloads,
+            self._fanout_mode,
         )
 
     async def async_added_to_hass(self):
@@ -162,11 +172,26 @@ class SmartIRLight(LightEntity, RestoreEntity):
             if ATTR_COLOR_TEMP_KELVIN in last_state.attributes:
                 self._colortemp = last_state.attributes[ATTR_COLOR_TEMP_KELVIN]
 
+        if self._colortemps:
+            self._colortemp_planner.restore(self._colortemp)
+        if self._brightnesses and self._brightness != 1:
+            self._brightness_planner.restore(self._brightness)
+
         if self._power_sensor:
             async_track_state_change_event(
                 self.hass, self._power_sensor, self._async_power_sensor_changed
             )
 
+    def add_to_platform_abort(self):
+        """Release the shared device data of an entity never added."""
+        super().add_to_platform_abort()
+        async_release_device_data('light', self._device_code)
+
+    async def async_will_remove_from_hass(self):
+        """Release the shared device data."""
+        await super().async_will_remove_from_hass()
+        async_release_device_data('light', self._device_code)
+
     @property
     def unique_id(self):
         """Return a unique ID."""
@@ -212,49 +237,32 @@ class SmartIRLight(LightEntity, RestoreEntity):
     def extra_state_attributes(self):
         """Platform specific attributes."""
         return {
-            "device_code": self._device_code,
-            "manufacturer": self._manufacturer,
-            "supported_models": self._supported_models,
-            'default_controller': self._default_controller,
-            "commands_encoding": self._commands_encoding,
+            **self._static_attributes,
             "on_by_remote": self._on_by_remote,
         }
 
     async def async_turn_on(self, **params):
         did_something = False
+        commands = []
         # Turn the light on if off
         if self._power != STATE_ON and not self._on_by_remote:
             self._power = STATE_ON
             did_something = True
-            await self.send_command(CMD_POWER_ON)
+            commands.append(CMD_POWER_ON)
 
         if (
             ATTR_COLOR_TEMP_KELVIN in params
             and ColorMode.COLOR_TEMP == self._support_color_mode
         ):
             target = params.get(ATTR_COLOR_TEMP_KELVIN)
-            old_color_temp = closest_match(self._colortemp, self._colortemps)
-            new_color_temp = closest_match(target, self._colortemps)
+            did_something = True
+            commands.extend(self._plan_presses(
+                self._colortemp_planner, target,
+                CMD_COLORMODE_COLDER, CMD_COLORMODE_WARMER))
             _LOGGER.debug(
-                f"Changing color temp from {self._colortemp}K step {old_color_temp} to {target}K step {new_color_temp}"
+                f"Changing color temp from {self._colortemp}K to {target}K"
             )
-
-            steps = new_color_temp - old_color_temp
-            did_something = True
-            if steps < 0:
-                cmd = CMD_COLORMODE_WARMER
-                steps = abs(steps)
-            else:
-                cmd = CMD_COLORMODE_COLDER
-
-            if steps > 0 and cmd:
-                # If we are heading for the highest or lowest value,
-                # take the opportunity to resync by issuing enough
-                # commands to go the full range.
-                if new_color_temp == len(self._colortemps) - 1 or new_color_temp == 0:
-                    steps = len(self._colortemps)
-                self._colortemp = self._colortemps[new_color_temp]
-                await self.send_command(cmd, steps)
+            self._colortemp = self._colortemp_planner.value
 
         if ATTR_BRIGHTNESS in params and self._support_brightness:
             # before checking the supported brightnesses, make a special case
@@ -263,35 +271,21 @@ class SmartIRLight(LightEntity, RestoreEntity):
                 self._brightness = 1
                 self._power = STATE_ON
                 did_something = True
-                await self.send_command(CMD_NIGHTLIGHT)
+                commands.append(CMD_NIGHTLIGHT)
+                # The night light is not one of the steps, so the next
+                # brightness change starts from an end stop.
+                self._brightness_planner.forget()
 
             elif self._brightnesses:
                 target = params.get(ATTR_BRIGHTNESS)
-                old_brightness = closest_match(self._brightness, self._brightnesses)
-                new_brightness = closest_match(target, self._brightnesses)
                 did_something = True
+                commands.extend(self._plan_presses(
+                    self._brightness_planner, target,
+                    CMD_BRIGHTNESS_INCREASE, CMD_BRIGHTNESS_DECREASE))
                 _LOGGER.debug(
-                    f"Changing brightness from {self._brightness} step {old_brightness} to {target} step {new_brightness}"
+                    f"Changing brightness from {self._brightness} to {target}"
                 )
-                steps = new_brightness - old_brightness
-                if steps < 0:
-                    cmd = CMD_BRIGHTNESS_DECREASE
-                    steps = abs(steps)
-                else:
-                    cmd = CMD_BRIGHTNESS_INCREASE
-
-                if steps > 0 and cmd:
-                    # If we are heading for the highest or lowest value,
-                    # take the opportunity to resync by issuing enough
-                    # commands to go the full range.
-                    if (
-                        new_brightness == len(self._brightnesses) - 1
-                        or new_brightness == 0
-                    ):
-                        steps = len(self._colortemps)
-                    did_something = True
-                    self._brightness = self._brightnesses[new_brightness]
-                    await self.send_command(cmd, steps)
+                self._brightness = self._brightness_planner.value
 
         # If we did nothing above, and the light is not detected as on
         # already issue the on command, even though we think the light
@@ -301,10 +295,26 @@ class SmartIRLight(LightEntity, RestoreEntity):
         # on and off are the same remote code.
         if not did_something and not self._on_by_remote:
             self._power = STATE_ON
-            await self.send_command(CMD_POWER_ON)
+            commands.append(CMD_POWER_ON)
+
+        if commands:
+            await self.send_commands(commands, fold=True)
 
         self.async_write_ha_state()
 
+    def _plan_presses(self, planner, target, cmd_up, cmd_down):
+        """Return the commands moving planner to target."""
+        presses = planner.plan(target)
+        _LOGGER.debug(
+            f"Planned {presses} to step {planner.value} "
+            f"(uncertainty {planner.uncertainty:g} steps)"
+        )
+        return [
+            cmd_down if direction == DOWN else cmd_up
+            for direction, count in presses
+            for _ in range(count)
+        ]
+
     async def async_turn_off(self):
         self._power = STATE_OFF
         await self.send_command(CMD_POWER_OFF)
@@ -314,16 +324,27 @@ class SmartIRLight(LightEntity, RestoreEntity):
         await (self.async_turn_on() if not self.is_on else self.async_turn_off())
 
     async def send_command(self, cmd, count=1):
-        if cmd not in self._commands:
-            _LOGGER.error(f"Unknown command '{cmd}'")
+        await self.send_commands([cmd] * count)
+
+    async def send_commands(self, cmds, fold=False):
+        """Send a sequence of commands as one batch.
+
+        With fold, repeated step presses may go out as one transmission.
+        """
+        unknown = [cmd for cmd in cmds if cmd not in self._commands]
+        if unknown:
+            _LOGGER.error(f"Unknown command '{unknown[0]}'")
             return
-        _LOGGER.debug(f"Sending {cmd} remote command {count} times.")
-        remote_cmd = self._commands.get(cmd)
+        _LOGGER.debug(f"Sending {len(cmds)} remote commands: {cmds}")
+        remote_cmds = [self._commands[cmd] for cmd in cmds]
         async with self._temp_lock:
             self._on_by_remote = False
             try:
-                for _ in range(count):
-                    await self._controller.send(remote_cmd)
+                if len(remote_cmds) == 1:
+                    await self._controller.send(remote_cmds[0], self._delay)
+                else:
+                    await self._controller.send_batch(
+                        remote_cmds, self._delay, self._pacing_guard, fold)
             except Exception as e:
                 _LOGGER.exception(e)
 
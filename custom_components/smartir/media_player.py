@@ -12,22 +12,30 @@ from homeassistant.components.media_player.const import (
     MediaPlayerEntityFeature, MediaType)
 from homeassistant.const import (
     CONF_NAME, STATE_OFF, STATE_ON, STATE_UNKNOWN)
+from homeassistant.core import Event, EventStateChangedData, callback
 import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers.debounce import Debouncer
+from homeassistant.helpers.event import async_track_state_change_event
 from homeassistant.helpers.restore_state import RestoreEntity
-from . import COMPONENT_ABS_DIR, Helper, async_get_device_data, CONF_DEVICE_CODE
-from .controller import get_controller
+from . import COMPONENT_ABS_DIR, Helper, async_get_device_data, async_release_device_data, static_attributes, STATIC_ATTRIBUTES, CONF_DEVICE_CODE
+from .controller import FANOUT_ALL, FANOUT_FIRST, get_controller
 
 _LOGGER = logging.getLogger(__name__)
 
 DEFAULT_NAME = "SmartIR Media Player"
 DEFAULT_DEVICE_CLASS = "tv"
 DEFAULT_DELAY = 0.5
+DEFAULT_PACING_GUARD = 0.1
 
 CONF_UNIQUE_ID = 'unique_id'
 CONF_CONTROLLER_DATA = "controller_data"
+CONF_FANOUT_MODE = "fanout_mode"
 CONF_CONTROLLER_TYPE = "controller_type"
 CONF_DELAY = "delay"
+CONF_PACING_GUARD = "pacing_guard"
+CONF_PROTOCOL_PAYLOADS = "protocol_payloads"
 CONF_POWER_SENSOR = 'power_sensor'
+CONF_POWER_SENSOR_DEBOUNCE = 'power_sensor_debounce'
 CONF_SOURCE_NAMES = 'source_names'
 CONF_DEVICE_CLASS = 'device_class'
 
@@ -36,43 +44,61 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
     vol.Optional(CONF_NAME, default=DEFAULT_NAME): cv.string,
     vol.Required(CONF_DEVICE_CODE): cv.positive_int,
     vol.Optional(CONF_CONTROLLER_TYPE): cv.string,
-    vol.Required(CONF_CONTROLLER_DATA): cv.string,
+    vol.Required(CONF_CONTROLLER_DATA): vol.Any(
+        cv.string, vol.All([cv.string], vol.Length(min=1))),
+    vol.Optional(CONF_FANOUT_MODE, default=FANOUT_ALL): vol.In(
+        [FANOUT_ALL, FANOUT_FIRST]),
     vol.Optional(CONF_DELAY, default=DEFAULT_DELAY): cv.string,
+    vol.Optional(CONF_PACING_GUARD, default=DEFAULT_PACING_GUARD): cv.positive_float,
+    vol.Optional(CONF_PROTOCOL_PAYLOADS, default=False): cv.boolean,
     vol.Optional(CONF_POWER_SENSOR): cv.entity_id,
+    vol.Optional(CONF_POWER_SENSOR_DEBOUNCE, default=0): cv.positive_float,
     vol.Optional(CONF_SOURCE_NAMES): dict,
     vol.Optional(CONF_DEVICE_CLASS, default=DEFAULT_DEVICE_CLASS): cv.string
 })
 
 async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up the IR Media Player platform."""
-    device_data = await async_get_device_data('media_player', config)
+    device_data = await async_get_device_data(hass, 'media_player', config)
     if device_data is None:
         return
 
-    async_add_entities([SmartIRMediaPlayer(
-        hass, config, device_data
-    )])
+    try:
+        entity = SmartIRMediaPlayer(hass, config, device_data)
+    except Exception:
+        async_release_device_data('media_player', config.get(CONF_DEVICE_CODE))
+        raise
+    async_add_entities([entity])
 
 class SmartIRMediaPlayer(MediaPlayerEntity, RestoreEntity):
+    _unrecorded_attributes = STATIC_ATTRIBUTES
+
     def __init__(self, hass, config, device_data):
         self.hass = hass
         self._unique_id = config.get(CONF_UNIQUE_ID)
         self._name = config.get(CONF_NAME)
         self._device_code = config.get(CONF_DEVICE_CODE)
         self._controller_data = config.get(CONF_CONTROLLER_DATA)
+        self._fanout_mode = config.get(CONF_FANOUT_MODE)
         self._delay = config.get(CONF_DELAY)
+        self._pacing_guard = config.get(CONF_PACING_GUARD)
+        self._protocol_payloads = config.get(CONF_PROTOCOL_PAYLOADS)
         self._power_sensor = config.get(CONF_POWER_SENSOR)
+        self._power_sensor_debounce = config.get(CONF_POWER_SENSOR_DEBOUNCE)
+        self._debouncer = None
 
         self._manufacturer = device_data['manufacturer']
         self._supported_models = device_data['supportedModels']
         self._default_controller = device_data.get('defaultController', None)
         self._commands_encoding = device_data['commandsEncoding']
+        self._static_attributes = static_attributes(self._device_code, device_data)
         self._commands = device_data['commands']
 
         self._controller_type = config.get(CONF_CONTROLLER_TYPE, self._default_controller)
 
         self._state = STATE_OFF
         self._sources_list = []
+        self._source_commands = {}
         self._source = None
         self._support_flags = 0
 
@@ -101,15 +127,19 @@ class SmartIRMediaPlayer(MediaPlayerEntity, RestoreEntity):
         if 'sources' in self._commands and self._commands['sources'] is not None:
             self._support_flags = self._support_flags | MediaPlayerEntityFeature.SELECT_SOURCE | MediaPlayerEntityFeature.PLAY_MEDIA
 
+            # The device data is shared with other entities, so rename the
+            # sources in a private copy.
+            self._source_commands = dict(self._commands['sources'])
+
             for source, new_name in config.get(CONF_SOURCE_NAMES, {}).items():
-                if source in self._commands['sources']:
+                if source in self._source_commands:
                     if new_name is not None:
-                        self._commands['sources'][new_name] = self._commands['sources'][source]
+                        self._source_commands[new_name] = self._source_commands[source]
 
-                    del self._commands['sources'][source]
+                    del self._source_commands[source]
 
             #Sources list
-            for key in self._commands['sources']:
+            for key in self._source_commands:
                 self._sources_list.append(key)
 
         self._temp_lock = asyncio.Lock()
@@ -120,7 +150,8 @@ class SmartIRMediaPlayer(MediaPlayerEntity, RestoreEntity):
             self._controller_type,
             self._commands_encoding,
             self._controller_data,
-            self._delay)
+            self._protocol_payloads,
+            self._fanout_mode)
 
     async def async_added_to_hass(self):
         """Run when entity about to be added."""
@@ -131,10 +162,37 @@ class SmartIRMediaPlayer(MediaPlayerEntity, RestoreEntity):
         if last_state is not None:
             self._state = last_state.state
 
+        if self._power_sensor:
+            # Wait for a flapping power sensor to settle before following it.
+            if self._power_sensor_debounce:
+                self._debouncer = Debouncer(
+                    self.hass,
+                    _LOGGER,
+                    cooldown=self._power_sensor_debounce,
+                    immediate=False,
+                    function=self._async_update_power_state)
+
+            self.async_on_remove(
+                async_track_state_change_event(self.hass, self._power_sensor,
+                                               self._async_power_sensor_changed))
+            self._update_power_state()
+
+    def add_to_platform_abort(self):
+        """Release the shared device data of an entity never added."""
+        super().add_to_platform_abort()
+        async_release_device_data('media_player', self._device_code)
+
+    async def async_will_remove_from_hass(self):
+        """Release the shared device data."""
+        await super().async_will_remove_from_hass()
+        if self._debouncer is not None:
+            self._debouncer.async_cancel()
+        async_release_device_data('media_player', self._device_code)
+
     @property
     def should_poll(self):
-        """Push an update after each command."""
-        return True
+        """The power sensor pushes its changes."""
+        return False
 
     @property
     def unique_id(self):
@@ -182,13 +240,7 @@ class SmartIRMediaPlayer(MediaPlayerEntity, RestoreEntity):
     @property
     def extra_state_attributes(self):
         """Platform specific attributes."""
-        return {
-            'device_code': self._device_code,
-            'manufacturer': self._manufacturer,
-            'supported_models': self._supported_models,
-            'default_controller': self._default_controller,
-            'commands_encoding': self._commands_encoding,
-        }
+        return self._static_attributes
 
     async def async_turn_off(self):
         """Turn the media player off."""
@@ -210,32 +262,27 @@ class SmartIRMediaPlayer(MediaPlayerEntity, RestoreEntity):
     async def async_media_previous_track(self):
         """Send previous track command."""
         await self.send_command(self._commands['previousChannel'])
-        self.async_write_ha_state()
 
     async def async_media_next_track(self):
         """Send next track command."""
         await self.send_command(self._commands['nextChannel'])
-        self.async_write_ha_state()
 
     async def async_volume_down(self):
         """Turn volume down for media player."""
         await self.send_command(self._commands['volumeDown'])
-        self.async_write_ha_state()
 
     async def async_volume_up(self):
         """Turn volume up for media player."""
         await self.send_command(self._commands['volumeUp'])
-        self.async_write_ha_state()
     
     async def async_mute_volume(self, mute):
         """Mute the volume."""
         await self.send_command(self._commands['mute'])
-        self.async_write_ha_state()
 
     async def async_select_source(self, source):
         """Select channel from source."""
         self._source = source
-        await self.send_command(self._commands['sources'][source])
+        await self.send_command(self._source_commands[source])
         self.async_write_ha_state()
 
     async def async_play_media(self, media_type, media_id, **kwargs):
@@ -251,26 +298,57 @@ class SmartIRMediaPlayer(MediaPlayerEntity, RestoreEntity):
             return
 
         self._source = "Channel {}".format(media_id)
-        for digit in media_id:
-            await self.send_command(self._commands['sources']["Channel {}".format(digit)])
+        await self.send_commands([
+            self._source_commands["Channel {}".format(digit)] for digit in media_id])
         self.async_write_ha_state()
 
     async def send_command(self, command):
         async with self._temp_lock:
             try:
-                await self._controller.send(command)
+                await self._controller.send(command, self._delay)
+            except Exception as e:
+                _LOGGER.exception(e)
+
+    async def send_commands(self, commands):
+        async with self._temp_lock:
+            try:
+                await self._controller.send_batch(commands, self._delay, self._pacing_guard)
             except Exception as e:
                 _LOGGER.exception(e)
             
-    async def async_update(self):
-        if self._power_sensor is None:
+    @callback
+    def _update_power_state(self):
+        """Follow the power sensor, return True if the state changed."""
+        power_state = self.hass.states.get(self._power_sensor)
+
+        if power_state is None or power_state.state not in (STATE_ON, STATE_OFF):
+            return False
+        if power_state.state == self._state:
+            return False
+
+        self._state = power_state.state
+        if self._state == STATE_OFF:
+            self._source = None
+        return True
+
+    @callback
+    def _async_update_power_state(self):
+        """Write the state if the power sensor changed it."""
+        if self._update_power_state():
+            self.async_write_ha_state()
+
+    async def _async_power_sensor_changed(self, event: Event[EventStateChangedData]) -> None:
+        """Handle power sensor changes."""
+        old_state = event.data["old_state"]
+        new_state = event.data["new_state"]
+
+        if new_state is None:
             return
 
-        power_state = self.hass.states.get(self._power_sensor)
+        if old_state is not None and new_state.state == old_state.state:
+            return
 
-        if power_state:
-            if power_state.state == STATE_OFF:
-                self._state = STATE_OFF
-                self._source = None
-            elif power_state.state == STATE_ON:
-                self._state = STATE_ON
+        if self._debouncer is not None:
+            await self._debouncer.async_call()
+        else:
+            self._async_update_power_state()
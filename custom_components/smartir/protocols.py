@@ -0,0 +1,197 @@
+"""Decoding of raw IR codes to common protocols.
+
+Recognizes NEC, Samsung and Sony codes in raw pulse arrays (microseconds,
+marks positive and spaces negative), so that controllers able to generate
+these protocols themselves can be sent the short protocol form instead of
+the whole pulse array.
+"""
+from collections import namedtuple
+import functools
+
+PROTOCOL_NEC = 'NEC'
+PROTOCOL_SAMSUNG = 'SAMSUNG'
+PROTOCOL_SONY = 'SONY'
+
+# Relative tolerance of pulse lengths.
+TOLERANCE = 0.25
+# Spaces at least this long in microseconds separate two frames.
+FRAME_GAP = 8000
+# Number of decoded codes kept by the decode() cache.
+DECODE_CACHE_SIZE = 1024
+
+# Largest value of an int variable of an ESPHome service (int32).
+ESPHOME_INT_MAX = 0x7FFFFFFF
+
+ProtocolCode = namedtuple(
+    'ProtocolCode', ['protocol', 'bits', 'data', 'repeat', 'full_repeat'])
+
+
+def _match(value, expected):
+    return abs(abs(value) - expected) <= expected * TOLERANCE
+
+
+def _frames(pulses):
+    """Split pulses into frames at long spaces, dropping the gaps."""
+    frames = []
+    frame = []
+
+    for pulse in pulses:
+        if pulse < 0 and -pulse >= FRAME_GAP:
+            if frame:
+                frames.append(frame)
+            frame = []
+        else:
+            frame.append(pulse)
+
+    if frame:
+        frames.append(frame)
+    return frames
+
+
+def _decode_pulse_distance(frame, header_mark, header_space, bit_mark,
+                           zero_space, one_space, bits):
+    """Decode a frame whose bits are told apart by the space length."""
+    if (len(frame) != 2 * bits + 3 or
+            not _match(frame[0], header_mark) or
+            not _match(frame[1], header_space) or
+            not _match(frame[-1], bit_mark)):
+        return None
+
+    data = 0
+    for i in range(2, 2 * bits + 2, 2):
+        mark, space = frame[i], frame[i + 1]
+        if mark <= 0 or space >= 0 or not _match(mark, bit_mark):
+            return None
+        if _match(space, one_space):
+            data = data << 1 | 1
+        elif _match(space, zero_space):
+            data <<= 1
+        else:
+            return None
+    return data
+
+
+def _decode_nec(frame):
+    return _decode_pulse_distance(frame, 9000, 4500, 560, 560, 1690, 32)
+
+
+def _decode_samsung(frame):
+    return _decode_pulse_distance(frame, 4500, 4500, 560, 560, 1690, 32)
+
+
+def _decode_sony(frame):
+    """Decode a Sony frame, which has no trailing mark."""
+    if len(frame) % 2 or len(frame) // 2 - 1 not in (12, 15, 20):
+        return None
+    if not _match(frame[0], 2400) or not _match(frame[1], 600):
+        return None
+
+    data = 0
+    for i in range(2, len(frame), 2):
+        mark = frame[i]
+        if mark <= 0:
+            return None
+        if _match(mark, 1200):
+            data = data << 1 | 1
+        elif _match(mark, 600):
+            data <<= 1
+        else:
+            return None
+        if frame[i + 1] >= 0 or not _match(frame[i + 1], 600):
+            return None
+    return data
+
+
+def _pad_sony(frame):
+    """Restore the last space of a Sony frame, merged into the frame gap."""
+    return frame + [-600] if len(frame) % 2 else frame
+
+
+def _is_nec_repeat(frame):
+    return (len(frame) == 3 and _match(frame[0], 9000) and
+            _match(frame[1], 2250) and _match(frame[2], 560))
+
+
+@functools.lru_cache(maxsize=DECODE_CACHE_SIZE)
+def decode(pulses):
+    """Return the ProtocolCode of a tuple of raw pulses, or None.
+
+    Data holds the bits in the order they are transmitted, the first bit
+    being the most significant one. Repeat is the number of extra frames
+    (or NEC repeat codes) following the first frame, full_repeat the number
+    of those that are full frames.
+    """
+    frames = _frames(pulses)
+    if not frames:
+        return None
+    first = frames[0]
+
+    data = _decode_nec(first)
+    if data is not None:
+        full_repeat = 0
+        for frame in frames[1:]:
+            if _decode_nec(frame) == data:
+                full_repeat += 1
+            elif not _is_nec_repeat(frame):
+                return None
+        return ProtocolCode(PROTOCOL_NEC, 32, data, len(frames) - 1, full_repeat)
+
+    data = _decode_samsung(first)
+    if data is not None:
+        if all(_decode_samsung(frame) == data for frame in frames[1:]):
+            return ProtocolCode(PROTOCOL_SAMSUNG, 32, data, len(frames) - 1,
+                                len(frames) - 1)
+        return None
+
+    frames = [_pad_sony(frame) for frame in frames]
+    data = _decode_sony(frames[0])
+    if data is not None and all(_decode_sony(frame) == data for frame in frames[1:]):
+        return ProtocolCode(PROTOCOL_SONY, len(frames[0]) // 2 - 1, data,
+                            len(frames) - 1, len(frames) - 1)
+
+    return None
+
+
+def _reverse_bits(value, bits):
+    return int(f"{value:0{bits}b}"[::-1], 2)
+
+
+def esphome_data(code):
+    """Return the service data of an ESPHome transmit action for code.
+
+    NEC codes are split into the 16 bit address and command ESPHome expects,
+    which are sent least significant bit first. Samsung codes are split into
+    16 bit halves, as service variables are 32 bit signed integers. Repeat
+    only counts full frames, ESPHome sends those and no NEC repeat codes.
+    Returns None if the code does not fit the service variables.
+    """
+    if code.protocol == PROTOCOL_NEC:
+        data = {
+            'address': _reverse_bits(code.data >> 16, 16),
+            'command': _reverse_bits(code.data & 0xFFFF, 16),
+        }
+    elif code.protocol == PROTOCOL_SAMSUNG:
+        data = {
+            'data_high': code.data >> 16,
+            'data_low': code.data & 0xFFFF,
+            'nbits': code.bits,
+        }
+    else:
+        data = {'data': code.data, 'nbits': code.bits}
+
+    data['repeat'] = code.full_repeat
+    if any(value > ESPHOME_INT_MAX for value in data.values()):
+        return None
+    return data
+
+
+def tasmota_payload(code):
+    """Return the Tasmota IRSend JSON payload of code as a dict."""
+    payload = {
+        'Protocol': code.protocol,
+        'Bits': code.bits,
+        'Data': f"0x{code.data:0{(code.bits + 3) // 4}X}",
+    }
+    if code.repeat:
+        payload['Repeat'] = code.repeat
+    return payload
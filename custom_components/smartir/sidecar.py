@@ -0,0 +1,262 @@
+"""Indexed binary sidecars for large climate device files.
+
+A sidecar is compiled from a climate JSON file and stored next to it. It
+holds the device metadata and a dense offset table for every
+(mode, fan, swing, temperature) leaf of the commands tree, so a lookup only
+touches the few bytes of the code being sent. The JSON file stays the
+source of truth: a sidecar older than its JSON file is ignored and rebuilt.
+
+Layout (little endian):
+
+    magic       8 bytes
+    header_len  uint32
+    header      JSON object with the metadata, the plain top level commands
+                ("off", "on", ...) and the key lists of every table axis
+    table       one (offset, length) uint32 pair per leaf, length 0 if the
+                combination is missing
+    blob        the code strings, identical codes are stored once
+"""
+from collections.abc import Mapping
+import json
+import logging
+import mmap
+import os
+import struct
+
+_LOGGER = logging.getLogger(__name__)
+
+SIDECAR_SUFFIX = '.idx'
+SIDECAR_MIN_SIZE = 256 * 1024
+
+_MAGIC = b'SIRIDX\x00\x01'
+_HEADER_LEN = struct.Struct('<I')
+_RECORD = struct.Struct('<II')
+
+
+def sidecar_path(device_path):
+    """Return the sidecar path for a device JSON file."""
+    return device_path + SIDECAR_SUFFIX
+
+
+def is_fresh(device_path):
+    """Return True if a sidecar exists and is newer than the JSON file."""
+    try:
+        return (os.path.getmtime(sidecar_path(device_path)) >=
+                os.path.getmtime(device_path))
+    except OSError:
+        return False
+
+
+def _collect_axes(commands, depth):
+    """Return the key lists of every table axis, or None if irregular."""
+    axes = [[] for _ in range(depth)]
+    seen = [set() for _ in range(depth)]
+    simple = {}
+
+    def walk(node, level):
+        for key, value in node.items():
+            if key not in seen[level]:
+                seen[level].add(key)
+                axes[level].append(key)
+            if level == depth - 1:
+                if not isinstance(value, str):
+                    return False
+            elif not isinstance(value, dict) or not walk(value, level + 1):
+                return False
+        return True
+
+    for key, value in commands.items():
+        if isinstance(value, str):
+            simple[key] = value
+        elif not isinstance(value, dict) or not walk({key: value}, 0):
+            return None, None
+
+    return axes, simple
+
+
+def build(device_path, device_data):
+    """Compile device_data into a sidecar next to device_path.
+
+    Returns False if the commands tree does not have the regular
+    mode/fan/[swing/]temperature shape and cannot be indexed.
+    """
+    commands = device_data.get('commands') or {}
+    depth = 4 if device_data.get('swingModes') else 3
+    axes, simple = _collect_axes(commands, depth)
+
+    if axes is None:
+        return False
+
+    strides = [1] * depth
+    for level in range(depth - 2, -1, -1):
+        strides[level] = strides[level + 1] * len(axes[level + 1])
+
+    index = [{key: i for i, key in enumerate(axis)} for axis in axes]
+    table = bytearray(_RECORD.size * strides[0] * len(axes[0]))
+    blob = bytearray()
+    offsets = {}
+
+    def walk(node, level, position):
+        for key, value in node.items():
+            pos = position + index[level][key] * strides[level]
+            if level < depth - 1:
+                walk(value, level + 1, pos)
+                continue
+            data = value.encode()
+            if data not in offsets:
+                offsets[data] = len(blob)
+                blob.extend(data)
+            _RECORD.pack_into(table, pos * _RECORD.size, offsets[data], len(data))
+
+    walk({k: v for k, v in commands.items() if isinstance(v, dict)}, 0, 0)
+
+    metadata = {k: v for k, v in device_data.items() if k != 'commands'}
+    header = json.dumps({
+        'metadata': metadata,
+        'commands': simple,
+        'axes': axes,
+    }).encode()
+
+    path = sidecar_path(device_path)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_MAGIC)
+        f.write(_HEADER_LEN.pack(len(header)))
+        f.write(header)
+        f.write(table)
+        f.write(blob)
+    os.replace(tmp_path, path)
+
+    _LOGGER.debug(f"Compiled {path} ({len(offsets)} unique codes)")
+    return True
+
+
+def load(device_path):
+    """Return the device data backed by the sidecar of device_path."""
+    with open(sidecar_path(device_path), 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if mm[:len(_MAGIC)] != _MAGIC:
+        mm.close()
+        raise ValueError(f"{sidecar_path(device_path)} is not a SmartIR sidecar")
+
+    header_start = len(_MAGIC) + _HEADER_LEN.size
+    (header_len,) = _HEADER_LEN.unpack_from(mm, len(_MAGIC))
+    header = json.loads(mm[header_start:header_start + header_len])
+
+    device_data = header['metadata']
+    device_data['commands'] = SidecarCommands(
+        mm, header_start + header_len, header['axes'], header['commands'])
+    return device_data
+
+
+class SidecarCommands(Mapping):
+    """Read-only view of a sidecar commands tree.
+
+    Behaves like the nested dict of the JSON file, leaves are read from the
+    memory mapped table on access.
+    """
+    def __init__(self, mm, table_start, axes, simple):
+        self._mm = mm
+        self._table_start = table_start
+        self._axes = axes
+        self._simple = simple
+        self._index = [{key: i for i, key in enumerate(axis)} for axis in axes]
+        self._strides = [1] * len(axes)
+        for level in range(len(axes) - 2, -1, -1):
+            self._strides[level] = self._strides[level + 1] * len(axes[level + 1])
+        self._blob_start = (table_start +
+                            _RECORD.size * self._strides[0] * len(axes[0]))
+        self._root = _SidecarNode(self, 0, 0)
+
+    def _read(self, position):
+        offset, length = _RECORD.unpack_from(
+            self._mm, self._table_start + position * _RECORD.size)
+        if length == 0:
+            return None
+        start = self._blob_start + offset
+        return self._mm[start:start + length].decode()
+
+    @property
+    def axes(self):
+        """Return the key lists of the mode, fan, [swing,] temp axes."""
+        return self._axes
+
+    def _has_leaf(self, level, position):
+        if level == len(self._axes):
+            return self._read(position) is not None
+        stride = self._strides[level]
+        return any(self._has_leaf(level + 1, position + i * stride)
+                   for i in range(len(self._axes[level])))
+
+    def _position(self, keys):
+        position = 0
+        for level, key in enumerate(keys):
+            i = self._index[level].get(key)
+            if i is None:
+                return None
+            position += i * self._strides[level]
+        return position
+
+    def lookup(self, *keys):
+        """Return the code at the given (mode, fan, [swing,] temp) or None."""
+        position = self._position(keys)
+        if position is None:
+            return None
+        return self._read(position)
+
+    def has(self, *keys):
+        """Return True if there is a code at the given keys, without reading it."""
+        position = self._position(keys)
+        if position is None:
+            return False
+        _, length = _RECORD.unpack_from(
+            self._mm, self._table_start + position * _RECORD.size)
+        return length != 0
+
+    def __getitem__(self, key):
+        if key in self._simple:
+            return self._simple[key]
+        return self._root[key]
+
+    def __iter__(self):
+        yield from self._simple
+        yield from self._root
+
+    def __len__(self):
+        return len(self._simple) + len(self._root)
+
+
+class _SidecarNode(Mapping):
+    """An inner level of a SidecarCommands tree."""
+    def __init__(self, commands, level, position):
+        self._commands = commands
+        self._level = level
+        self._position = position
+
+    def __getitem__(self, key):
+        commands = self._commands
+        i = commands._index[self._level].get(key)
+        if i is None:
+            raise KeyError(key)
+        position = self._position + i * commands._strides[self._level]
+
+        if self._level == len(commands._axes) - 1:
+            code = commands._read(position)
+            if code is None:
+                raise KeyError(key)
+            return code
+
+        if not commands._has_leaf(self._level + 1, position):
+            raise KeyError(key)
+        return _SidecarNode(commands, self._level + 1, position)
+
+    def __iter__(self):
+        commands = self._commands
+        stride = commands._strides[self._level]
+        for i, key in enumerate(commands._axes[self._level]):
+            if commands._has_leaf(self._level + 1, self._position + i * stride):
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
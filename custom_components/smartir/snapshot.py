@@ -0,0 +1,112 @@
+"""Persistent snapshots of parsed device files.
+
+A snapshot stores the parsed and validated device data of a JSON file as
+marshal data, keyed by the SHA-256 of the file content and by the loader
+version. Loading it on the next start skips the JSON parsing entirely;
+any other content, loader or Python version falls back to a normal parse.
+
+Layout: magic, a uint32 header length, a marshalled header tuple
+(key, metadata, spans) and one marshalled blob per commands entry, spans
+being relative to the end of the header. The commands are decoded lazily
+from the memory mapped snapshot.
+"""
+import hashlib
+import logging
+import marshal
+import mmap
+import os
+import struct
+import sys
+
+from .lazy_json import LazyCommands
+
+_LOGGER = logging.getLogger(__name__)
+
+# Bump when the parsing or validation of device files changes.
+LOADER_VERSION = 2
+
+SNAPSHOT_SUFFIX = '.snapshot'
+
+_MAGIC = b'SIRSNAP\x01'
+_HEADER_LEN = struct.Struct('<I')
+
+
+def file_digest(path):
+    """Return the SHA-256 hex digest of a file."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return hashlib.sha256(mm).hexdigest()
+
+
+def _key(digest):
+    return (LOADER_VERSION, marshal.version, sys.version_info[:2], digest)
+
+
+def load(snapshot_path, digest):
+    """Return the device data stored in a snapshot, or None if stale."""
+    try:
+        with open(snapshot_path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    try:
+        if mm[:len(_MAGIC)] != _MAGIC:
+            raise ValueError("bad magic")
+        header_start = len(_MAGIC) + _HEADER_LEN.size
+        (header_len,) = _HEADER_LEN.unpack_from(mm, len(_MAGIC))
+        key, metadata, spans = marshal.loads(
+            mm[header_start:header_start + header_len])
+    except (ValueError, EOFError, TypeError, struct.error) as e:
+        _LOGGER.debug(f"Ignoring unreadable snapshot {snapshot_path}: {e}")
+        mm.close()
+        return None
+
+    if key != _key(digest):
+        mm.close()
+        return None
+
+    device_data = metadata
+    if spans is not None:
+        # Spans are stored relative to the end of the header.
+        body_start = header_start + header_len
+        spans = {k: (start + body_start, end + body_start)
+                 for k, (start, end) in spans.items()}
+        device_data['commands'] = LazyCommands(mm, spans, marshal.loads)
+    return device_data
+
+
+def save(snapshot_path, digest, device_data):
+    """Write a snapshot of device_data for a file with the given digest."""
+    metadata = {k: v for k, v in device_data.items() if k != 'commands'}
+    spans = None
+    blobs = []
+
+    if 'commands' in device_data:
+        commands = device_data['commands']
+        if isinstance(commands, LazyCommands):
+            items = commands.iter_decoded()
+        else:
+            items = commands.items()
+
+        spans = {}
+        offset = 0
+        for key, value in items:
+            blob = marshal.dumps(value)
+            spans[key] = (offset, offset + len(blob))
+            blobs.append(blob)
+            offset += len(blob)
+
+    header = marshal.dumps((_key(digest), metadata, spans))
+
+    os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+    tmp_path = snapshot_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_MAGIC)
+        f.write(_HEADER_LEN.pack(len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, snapshot_path)
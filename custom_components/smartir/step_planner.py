@@ -0,0 +1,114 @@
+"""Press planning for stepped controls.
+
+Lights and other devices without absolute commands are driven by up/down
+presses over a fixed list of levels. Since IR presses can be lost, the
+planner tracks both the estimated level and how many steps it may be off
+by. Moves use the fewest presses, and a resync (pressing into an end stop
+so the position is known again) is only added once the uncertainty reaches
+a threshold, or for free when the target is an end stop anyway.
+"""
+import bisect
+import math
+
+UP = 1
+DOWN = -1
+
+# Steps of uncertainty added by each press, i.e. one press in 20 is
+# assumed to be lost.
+PRESS_UNCERTAINTY = 0.05
+DEFAULT_RESYNC_THRESHOLD = 1
+
+
+def closest_index(levels, value):
+    """Return the index of the level closest to value in sorted levels.
+
+    Ties go to the higher level.
+    """
+    i = bisect.bisect_left(levels, value)
+    if i == 0:
+        return 0
+    if i == len(levels):
+        return len(levels) - 1
+    if value - levels[i - 1] < levels[i] - value:
+        return i - 1
+    return i
+
+
+class StepPlanner():
+    """The estimated position of a stepped control and its uncertainty."""
+    def __init__(self, levels, resync_threshold=DEFAULT_RESYNC_THRESHOLD,
+                 press_uncertainty=PRESS_UNCERTAINTY):
+        self.levels = levels
+        self.resync_threshold = resync_threshold
+        self.press_uncertainty = press_uncertainty
+        self._position = None
+        self._uncertainty = 0
+
+    @property
+    def value(self):
+        """Return the estimated level, or None if unknown."""
+        if self._position is None:
+            return None
+        return self.levels[self._position]
+
+    @property
+    def uncertainty(self):
+        """Return the number of steps the estimate may be off by."""
+        if self._position is None:
+            return len(self.levels) - 1
+        return self._uncertainty
+
+    def restore(self, value):
+        """Set the estimated position, e.g. from the restored state."""
+        if value is None:
+            self.forget()
+        else:
+            self._position = closest_index(self.levels, value)
+
+    def forget(self):
+        """Mark the position unknown, the next move resyncs."""
+        self._position = None
+        self._uncertainty = 0
+
+    def plan(self, value):
+        """Return the presses moving to the level closest to value.
+
+        Presses are a list of (direction, count) and the estimate is
+        updated as if they were all sent.
+        """
+        last = len(self.levels) - 1
+        target = closest_index(self.levels, value)
+        uncertainty = self.uncertainty
+
+        if self._position is not None and uncertainty < self.resync_threshold and not (
+                uncertainty and target in (0, last)):
+            steps = target - self._position
+            presses = [(UP if steps > 0 else DOWN, abs(steps))]
+            self._uncertainty = uncertainty + abs(steps) * self.press_uncertainty
+        else:
+            presses = self._plan_resync(target, uncertainty)
+            # Only the presses back from the end stop may have been lost.
+            back = presses[1][1] if len(presses) > 1 else 0
+            self._uncertainty = back * self.press_uncertainty
+
+        self._position = target
+        return [(direction, count) for direction, count in presses if count]
+
+    def _plan_resync(self, target, uncertainty):
+        """Return the cheapest presses through an end stop to target."""
+        last = len(self.levels) - 1
+        plans = []
+
+        for end, direction in ((0, DOWN), (last, UP)):
+            if self._position is None:
+                to_end = last
+            else:
+                to_end = min(last, abs(self._position - end) +
+                             max(1, math.ceil(uncertainty)))
+            back = abs(end - target)
+            presses = [(direction, to_end)]
+            if back:
+                presses.append((-direction, back))
+            plans.append((to_end + back, presses))
+
+        return min(plans, key=lambda plan: plan[0])[1]
@@ -0,0 +1,122 @@
+"""Compare cold and warm load times of the largest device files.
+
+Each loader is measured on the files it serves: the persistent snapshot on
+the largest files below the sidecar size (and non climate files), the
+compiled sidecar on the largest climate files. Cold loads parse the JSON
+file as the integration does, warm loads reuse what the cold load wrote.
+Files are copied to a temporary directory so the repository is left
+untouched.
+
+    python scripts/benchmark_device_data.py [count]
+"""
+import glob
+import importlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMPONENT_DIR = os.path.join(ROOT, 'custom_components', 'smartir')
+CODES_DIR = os.path.join(ROOT, 'codes')
+
+# Import the loader modules without running the integration's __init__,
+# which needs Home Assistant.
+package = types.ModuleType('smartir')
+package.__path__ = [COMPONENT_DIR]
+sys.modules['smartir'] = package
+lazy_json = importlib.import_module('smartir.lazy_json')
+sidecar = importlib.import_module('smartir.sidecar')
+snapshot = importlib.import_module('smartir.snapshot')
+
+
+def timed(func, *args, repeat=5):
+    """Return the best wall time of func(*args) in milliseconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def json_load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def parse(path):
+    """Parse a device file the way the integration does without a snapshot."""
+    if os.path.getsize(path) >= lazy_json.LAZY_MIN_SIZE:
+        return lazy_json.load(path)
+    return json_load(path)
+
+
+def snapshot_cold(path, snapshot_path):
+    digest = snapshot.file_digest(path)
+    snapshot.save(snapshot_path, digest, parse(path))
+
+
+def snapshot_warm(path, snapshot_path):
+    return snapshot.load(snapshot_path, snapshot.file_digest(path))
+
+
+def sidecar_cold(path):
+    sidecar.build(path, lazy_json.load(path))
+    return sidecar.load(path)
+
+
+def largest(files, count):
+    return sorted(files, key=os.path.getsize, reverse=True)[:count]
+
+
+def uses_sidecar(path):
+    return (os.path.basename(os.path.dirname(path)) == 'climate' and
+            os.path.getsize(path) >= sidecar.SIDECAR_MIN_SIZE)
+
+
+def copy(source, tmp):
+    name = f"{os.path.basename(os.path.dirname(source))}_{os.path.basename(source)}"
+    path = os.path.join(tmp, name)
+    shutil.copyfile(source, path)
+    return name, path
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    files = glob.glob(os.path.join(CODES_DIR, '*', '*.json'))
+    snapshot_files = largest([f for f in files if not uses_sidecar(f)], count)
+    sidecar_files = largest([f for f in files if uses_sidecar(f)], count)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'snapshot':<20}{'size':>10}{'parse':>11}{'cold':>11}{'warm':>11}  (ms)")
+        for source in snapshot_files:
+            name, path = copy(source, tmp)
+            snapshot_path = os.path.join(tmp, name + snapshot.SNAPSHOT_SUFFIX)
+            results = (
+                timed(parse, path),
+                timed(snapshot_cold, path, snapshot_path),
+                timed(snapshot_warm, path, snapshot_path),
+            )
+            print(f"{name:<20}{os.path.getsize(path):>10}" +
+                  ''.join(f"{r:>11.2f}" for r in results))
+
+        print()
+        print(f"{'sidecar':<20}{'size':>10}{'parse':>11}{'cold':>11}{'warm':>11}  (ms)")
+        for source in sidecar_files:
+            name, path = copy(source, tmp)
+            results = (
+                timed(json_load, path),
+                timed(sidecar_cold, path),
+                timed(sidecar.load, path),
+            )
+            print(f"{name:<20}{os.path.getsize(path):>10}" +
+                  ''.join(f"{r:>11.2f}" for r in results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Tests of the Broadlink UDP transport against a local stand-in device."""
+import asyncio
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+import pytest
+
+from custom_components.smartir import broadlink_udp
+
+SESSION_KEY = bytes(range(16))
+SESSION_ID = 1234
+PACKET = bytes([0x26, 0, 4, 0, 1, 2, 3, 4])
+
+
+def _aes(key):
+    return Cipher(algorithms.AES(key), modes.CBC(broadlink_udp.DEFAULT_IV))
+
+
+class StandInDevice(asyncio.DatagramProtocol):
+    """Answers hello, auth and send_data requests like a Broadlink RM."""
+    def __init__(self, devtype):
+        self.devtype = devtype
+        self.key = broadlink_udp.DEFAULT_KEY
+        self.auths = 0
+        self.sent = []
+        self.drop_sends = 0
+        self.reject_sends = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        command = int.from_bytes(data[0x26:0x28], 'little')
+        if command == broadlink_udp.CMD_HELLO:
+            response = bytearray(0x40)
+            response[0x34:0x36] = self.devtype.to_bytes(2, 'little')
+            response[0x3A:0x40] = bytes([1, 2, 3, 4, 5, 6])
+            self.transport.sendto(bytes(response), addr)
+            return
+
+        response = bytearray(0x38)
+        response[0x28:0x2A] = data[0x28:0x2A]
+
+        if command == broadlink_udp.CMD_AUTH:
+            self.auths += 1
+            self.key = SESSION_KEY
+            payload = SESSION_ID.to_bytes(4, 'little') + SESSION_KEY + bytes(12)
+            encryptor = _aes(broadlink_udp.DEFAULT_KEY).encryptor()
+            response += encryptor.update(payload) + encryptor.finalize()
+        elif command == broadlink_udp.CMD_COMMAND:
+            if self.drop_sends:
+                self.drop_sends -= 1
+                return
+            if self.reject_sends:
+                self.reject_sends -= 1
+                response[0x22:0x24] = broadlink_udp.ERROR_AUTH.to_bytes(2, 'little', signed=True)
+            else:
+                decryptor = _aes(self.key).decryptor()
+                self.sent.append(decryptor.update(bytes(data[0x38:])) + decryptor.finalize())
+
+        self.transport.sendto(bytes(response), addr)
+
+
+@pytest.fixture
+async def stand_in(request):
+    """Start a stand-in device, returning it and a BroadlinkDevice for it."""
+    loop = asyncio.get_running_loop()
+    transport, device = await loop.create_datagram_endpoint(
+        lambda: StandInDevice(request.param), local_addr=('127.0.0.1', 0))
+    client = broadlink_udp.BroadlinkDevice(
+        '127.0.0.1', transport.get_extra_info('sockname')[1])
+    yield device, client
+    client.close()
+    transport.close()
+
+
+@pytest.mark.parametrize('stand_in', [0x2737, 0x520B], indirect=True)
+async def test_send_data(stand_in):
+    """The first send authenticates, later ones reuse the session."""
+    device, client = stand_in
+
+    await client.send_data(PACKET)
+    await client.send_data(PACKET)
+
+    assert device.auths == 1
+    prefix = b'\x0c\x00' if device.devtype >= broadlink_udp.LENGTH_PREFIX_MIN_DEVTYPE else b''
+    payload = prefix + b'\x02\x00\x00\x00' + PACKET
+    assert device.sent == [payload + bytes(-len(payload) % 16)] * 2
+
+
+@pytest.mark.parametrize('stand_in', [0x2737], indirect=True)
+async def test_send_data_timeout_retry(stand_in, monkeypatch):
+    """A lost answer sets the session up again and resends."""
+    monkeypatch.setattr(broadlink_udp, 'REQUEST_TIMEOUT', 0.2)
+    device, client = stand_in
+
+    await client.send_data(PACKET)
+    device.drop_sends = 1
+    await client.send_data(PACKET)
+
+    assert device.auths == 2
+    assert len(device.sent) == 2
+
+
+@pytest.mark.parametrize('stand_in', [0x2737], indirect=True)
+async def test_send_data_reauthenticates(stand_in):
+    """An auth error (-7) authenticates again before resending."""
+    device, client = stand_in
+
+    await client.send_data(PACKET)
+    device.reject_sends = 1
+    await client.send_data(PACKET)
+
+    assert device.auths == 2
+    assert len(device.sent) == 2
+
+
+@pytest.mark.parametrize('stand_in', [0x2737], indirect=True)
+async def test_send_data_gives_up(stand_in, monkeypatch):
+    """A device that never answers fails after REQUEST_RETRIES resends."""
+    monkeypatch.setattr(broadlink_udp, 'REQUEST_TIMEOUT', 0.1)
+    device, client = stand_in
+    device.drop_sends = broadlink_udp.REQUEST_RETRIES + 1
+
+    with pytest.raises(TimeoutError):
+        await client.send_data(PACKET)
+    assert device.sent == []
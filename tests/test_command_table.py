@@ -0,0 +1,108 @@
+"""Tests of the flat command tables of JSON climate devices."""
+import copy
+import json
+from pathlib import Path
+import shutil
+
+from custom_components.smartir import lazy_json
+from custom_components.smartir.command_table import (
+    PROBLEMS_KEY,
+    CommandTable,
+    compile_commands,
+)
+
+CODES_DIR = Path(__file__).parent.parent / 'codes' / 'climate'
+
+DEVICE = {
+    'minTemperature': 18,
+    'maxTemperature': 20,
+    'precision': 1,
+    'operationModes': ['cool', 'heat'],
+    'fanModes': ['low'],
+    'commands': {
+        'off': 'OFF',
+        'cool': {'low': {'18': 'A', '19': 'B', '20': ''}},
+        'heat': {'low': {'18': 'C', '20.0': 'D'}},
+    },
+}
+
+
+def device(**changes):
+    """Return a copy of DEVICE with changes."""
+    return dict(copy.deepcopy(DEVICE), **changes)
+
+
+def test_get():
+    """Temperatures match whatever their type, unknown states give None."""
+    table, _ = compile_commands(device(), 'test')
+
+    assert table.get('cool', 'low', None, 18) == 'A'
+    assert table.get('cool', 'low', None, '19') == 'B'
+    assert table.get('heat', 'low', None, 20) == 'D'
+    assert table.get('heat', 'low', None, 19) is None
+    assert table.get('dry', 'low', None, 18) is None
+
+
+def test_get_nearest():
+    """With nearest, a missing temperature falls back to the closest one."""
+    table, _ = compile_commands(device(), 'test')
+
+    assert table.get('heat', 'low', None, 21, nearest=True) == 'D'
+    assert table.get('heat', 'low', None, 16, nearest=True) == 'C'
+    assert table.get('cool', 'low', None, 20, nearest=True) == 'B'
+    assert table.get('cool', 'high', None, 20, nearest=True) is None
+
+
+def test_problems():
+    """Leaves that are not codes and missing combinations are reported."""
+    table, problems = compile_commands(device(), 'test')
+
+    assert problems == [
+        "cool/low/20 is not a code",
+        "1 combinations have no code: cool/low/20",
+        "1 combinations have no code: heat/low/19",
+    ]
+    assert table.get('cool', 'low', None, 20) is None
+
+
+def test_swing():
+    """The swing mode is part of the key only for devices with swing modes."""
+    data = device(swingModes=['on'], operationModes=['cool'], commands={
+        'cool': {'low': {'on': {'18': 'A', '19': 'B', '20': 'C'}}}})
+    table, problems = compile_commands(data, 'test')
+
+    assert problems == []
+    assert table.get('cool', 'low', 'on', 19) == 'B'
+    assert table.get('cool', 'low', 'off', 19) is None
+
+    table = CommandTable(device(), 'test')
+    assert table.get('cool', 'low', 'on', 19) == 'B'
+
+
+def test_lazy_commands(tmp_path):
+    """Lazy commands are only decoded on use and report the same problems."""
+    path = tmp_path / 'device.json'
+    path.write_text(json.dumps(device()))
+    data = lazy_json.load(path)
+
+    table, problems = compile_commands(data, 'test')
+
+    assert problems == compile_commands(device(), 'test')[1]
+    assert table.get('heat', 'low', None, 18) == 'C'
+    assert compile_commands(dict(data, **{PROBLEMS_KEY: ['kept']}), 'test')[1] == ['kept']
+
+
+def test_real_device_file(tmp_path):
+    """A device file gives the same table whether parsed or loaded lazily."""
+    path = shutil.copy(CODES_DIR / '1000.json', tmp_path)
+    with open(path) as f:
+        data = json.load(f)
+    table, problems = compile_commands(data, path)
+    lazy_table, lazy_problems = compile_commands(lazy_json.load(path), path)
+
+    assert sorted(lazy_problems) == sorted(problems)
+    for mode in data['operationModes']:
+        for fan, codes in data['commands'][mode].items():
+            for temperature, code in codes.items():
+                assert table.get(mode, fan, None, temperature) == code
+                assert lazy_table.get(mode, fan, None, temperature) == code
@@ -0,0 +1,71 @@
+"""Tests of the controller layer."""
+from base64 import b64decode, b64encode
+
+import pytest
+from pytest_homeassistant_custom_component.common import async_mock_service
+
+from custom_components.smartir.controller import get_controller
+
+
+def broadlink_code(*pulses):
+    """Return a Base64 Broadlink IR code of the given pulse ticks."""
+    data = bytes(pulses)
+    return b64encode(bytes([0x26, 0]) + len(data).to_bytes(2, 'little') + data).decode()
+
+
+CODE_A = broadlink_code(10, 20, 10, 20)
+CODE_B = broadlink_code(30, 40, 30, 40)
+CODE_C = broadlink_code(50, 60, 50, 60)
+
+
+async def test_send_batch_list_command(hass):
+    """A command made of a list of codes is sent as its own group."""
+    calls = async_mock_service(hass, 'remote', 'send_command')
+    controller = get_controller(hass, 'Broadlink', 'Base64', 'remote.list_batch')
+
+    await controller.send_batch([CODE_A, [CODE_B, CODE_C]], 0.5, 0.1)
+
+    assert len(calls) == 2
+    assert calls[0].data['command'] == ['b64:' + CODE_A]
+    assert calls[1].data['command'] == ['b64:' + CODE_B, 'b64:' + CODE_C]
+    assert calls[1].data['delay_secs'] == 0.5
+
+
+async def test_send_batch_folds_only_on_request(hass):
+    """Identical commands are folded into a repeat packet only with fold."""
+    calls = async_mock_service(hass, 'remote', 'send_command')
+    controller = get_controller(hass, 'Broadlink', 'Base64', 'remote.fold_batch')
+
+    await controller.send_batch([CODE_A] * 2, 0.5, 0.1)
+    await controller.send_batch([CODE_A] * 2, 0.5, 0.1, fold=True)
+
+    assert calls[0].data['command'] == ['b64:' + CODE_A] * 2
+    (folded,) = calls[1].data['command']
+    assert b64decode(folded[4:])[1] == 1
+
+
+LEARNED_PRONTO = "0000 006C 0002 0000 0157 00AC 0015 0689"
+
+
+async def test_xiaomi_pronto_repeats(hass):
+    """Folded Pronto repeats play once per press through python-miio."""
+    miio = pytest.importorskip('miio')
+    try:
+        from miio.integrations.chuangmi.remote.chuangmi_ir import ChuangmiIrSignal
+    except ImportError:
+        from miio.chuangmi_ir import ChuangmiIrSignal
+
+    calls = async_mock_service(hass, 'remote', 'send_command')
+    controller = get_controller(hass, 'Xiaomi', 'Pronto', 'remote.xiaomi_repeats')
+
+    await controller.send_batch([LEARNED_PRONTO] * 3, 0.5, 0.1, fold=True)
+
+    assert len(calls) == 1
+    (payload,) = calls[0].data['command']
+    _, code, repeats = payload.split(':')
+
+    def edge_pairs(*args):
+        raw, _ = miio.ChuangmiIr.pronto_to_raw(*args)
+        return ChuangmiIrSignal.parse(b64decode(raw)).edge_pairs
+
+    assert len(edge_pairs(code, int(repeats))) == 3 * len(edge_pairs(LEARNED_PRONTO))
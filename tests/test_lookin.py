@@ -0,0 +1,56 @@
+"""Tests of the LOOKin controller against a local stand-in HTTP server."""
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+import pytest
+
+from custom_components.smartir.controller import get_controller, get_lookin_host
+
+PRONTO = "0000 006C 0002 0000 0157 00AC 0015 0689"
+
+
+@pytest.fixture
+async def lookin_server():
+    """Start a stand-in LOOKin device, returning its host and the requests."""
+    received = []
+
+    async def handle_command(request):
+        received.append((request.match_info['encoding'], request.match_info['code']))
+        if request.match_info['code'] == 'fail':
+            return web.Response(status=500)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get('/commands/ir/{encoding}/{code}', handle_command)
+    server = TestServer(app, host='127.0.0.1')
+    await server.start_server()
+    yield f"127.0.0.1:{server.port}", received
+    await server.close()
+
+
+async def test_lookin_send(hass, lookin_server):
+    """Commands are sent over the shared session and counted."""
+    host, received = lookin_server
+    controller = get_controller(hass, 'LOOKin', 'Pronto', host)
+
+    await controller.send(PRONTO)
+    await controller.send(PRONTO)
+
+    assert received == [('prontohex', PRONTO)] * 2
+    stats = get_lookin_host(host).get_stats()
+    assert stats['requests'] == 2
+    assert stats['errors'] == 0
+
+
+async def test_lookin_send_error(hass, lookin_server):
+    """An error answer fails the send and is counted."""
+    host, received = lookin_server
+    controller = get_controller(hass, 'LOOKin', 'Pronto', host)
+
+    with pytest.raises(aiohttp.ClientResponseError):
+        await controller.send('fail')
+
+    assert received == [('prontohex', 'fail')]
+    stats = get_lookin_host(host).get_stats()
+    assert stats['requests'] == 1
+    assert stats['errors'] == 1
@@ -0,0 +1,105 @@
+"""Tests of the protocol decoder on synthetic pulse trains."""
+from custom_components.smartir.protocols import (
+    PROTOCOL_NEC,
+    PROTOCOL_SAMSUNG,
+    PROTOCOL_SONY,
+    ProtocolCode,
+    decode,
+    esphome_data,
+    tasmota_payload,
+)
+
+GAP = -40000
+NEC_REPEAT = [9000, -2250, 560]
+
+
+def _bits(data, bits):
+    """Return the bits of data, most significant first."""
+    return [(data >> i) & 1 for i in range(bits - 1, -1, -1)]
+
+
+def pulse_distance_frame(header_mark, header_space, data, bits=32):
+    """Return a pulse distance frame as sent by NEC and Samsung remotes."""
+    frame = [header_mark, -header_space]
+    for bit in _bits(data, bits):
+        frame += [560, -1690 if bit else -560]
+    return frame + [560]
+
+
+def nec_frame(data):
+    return pulse_distance_frame(9000, 4500, data)
+
+
+def samsung_frame(data):
+    return pulse_distance_frame(4500, 4500, data)
+
+
+def sony_frame(data, bits):
+    frame = [2400, -600]
+    for bit in _bits(data, bits):
+        frame += [1200 if bit else 600, -600]
+    # The last space is merged into the frame gap.
+    return frame[:-1]
+
+
+def train(*frames):
+    """Return the pulses of frames separated by gaps."""
+    pulses = []
+    for frame in frames:
+        if pulses:
+            pulses.append(GAP)
+        pulses += frame
+    return tuple(pulses)
+
+
+def test_decode_nec_with_repeat_codes():
+    """NEC repeat codes count for Tasmota but are not sent as ESPHome frames."""
+    code = decode(train(nec_frame(0x20DF10EF), NEC_REPEAT, NEC_REPEAT))
+
+    assert code == ProtocolCode(PROTOCOL_NEC, 32, 0x20DF10EF, 2, 0)
+    assert esphome_data(code) == {'address': 0xFB04, 'command': 0xF708, 'repeat': 0}
+    assert tasmota_payload(code) == {
+        'Protocol': 'NEC', 'Bits': 32, 'Data': '0x20DF10EF', 'Repeat': 2}
+
+
+def test_decode_nec_with_full_frames():
+    """Only the repeated full NEC frames count for ESPHome."""
+    code = decode(train(nec_frame(0x20DF10EF), nec_frame(0x20DF10EF), NEC_REPEAT))
+
+    assert code.repeat == 2
+    assert code.full_repeat == 1
+    assert esphome_data(code)['repeat'] == 1
+
+
+def test_decode_samsung():
+    """Samsung data is split into halves that fit an ESPHome int."""
+    code = decode(train(samsung_frame(0xE0E040BF)))
+
+    assert code == ProtocolCode(PROTOCOL_SAMSUNG, 32, 0xE0E040BF, 0, 0)
+    assert esphome_data(code) == {
+        'data_high': 0xE0E0, 'data_low': 0x40BF, 'nbits': 32, 'repeat': 0}
+    assert tasmota_payload(code) == {
+        'Protocol': 'SAMSUNG', 'Bits': 32, 'Data': '0xE0E040BF'}
+
+
+def test_decode_sony_repeated():
+    """Repeated Sony frames decode to a repeat count."""
+    frame = sony_frame(0xA90, 12)
+    code = decode(train(frame, frame, frame))
+
+    assert code == ProtocolCode(PROTOCOL_SONY, 12, 0xA90, 2, 2)
+    assert esphome_data(code) == {'data': 0xA90, 'nbits': 12, 'repeat': 2}
+    assert tasmota_payload(code) == {
+        'Protocol': 'SONY', 'Bits': 12, 'Data': '0xA90', 'Repeat': 2}
+
+
+def test_decode_unknown():
+    """Pulses of no known protocol, or mixed frames, do not decode."""
+    assert decode(train([3000, -3000, 500, -500, 500])) is None
+    assert decode(train(nec_frame(0x20DF10EF), nec_frame(0x20DF10EE))) is None
+    assert decode(()) is None
+
+
+def test_esphome_data_out_of_range():
+    """Values ESPHome cannot take as an int give no payload."""
+    assert esphome_data(ProtocolCode(PROTOCOL_SONY, 32, 0x80000000, 0, 0)) is None
@@ -0,0 +1,69 @@
+"""Tests of the indexed sidecars of climate device files."""
+from collections.abc import Mapping
+import json
+from pathlib import Path
+import shutil
+
+import pytest
+
+from custom_components.smartir import sidecar
+
+CODES_DIR = Path(__file__).parent.parent / 'codes' / 'climate'
+
+
+def to_dict(node):
+    """Return a Mapping tree as nested dicts."""
+    return {k: to_dict(v) if isinstance(v, Mapping) else v for k, v in node.items()}
+
+
+@pytest.mark.parametrize('device_code', [1000, 2700])
+def test_round_trip(tmp_path, device_code):
+    """A sidecar reads back the device file as parsed by json.load."""
+    path = shutil.copy(CODES_DIR / f"{device_code}.json", tmp_path)
+    with open(path) as f:
+        data = json.load(f)
+
+    assert sidecar.build(path, data)
+    assert sidecar.is_fresh(path)
+    loaded = sidecar.load(path)
+
+    commands = loaded.pop('commands')
+    expected = data.pop('commands')
+    assert loaded == data
+    assert to_dict(commands) == expected
+
+
+def test_lookup(tmp_path):
+    """Leaves are looked up by their keys, missing ones give None."""
+    path = tmp_path / 'device.json'
+    data = {
+        'manufacturer': 'Test',
+        'commands': {
+            'off': 'OFF',
+            'cool': {'low': {'18': 'A', '19': 'B'}, 'high': {'19': 'A'}},
+        },
+    }
+    path.write_text(json.dumps(data))
+
+    assert sidecar.build(str(path), data)
+    commands = sidecar.load(str(path))['commands']
+
+    assert commands['off'] == 'OFF'
+    assert commands.axes == [['cool'], ['low', 'high'], ['18', '19']]
+    assert commands.lookup('cool', 'high', '19') == 'A'
+    assert commands.lookup('cool', 'high', '18') is None
+    assert commands.lookup('heat', 'low', '18') is None
+    assert commands.has('cool', 'low', '18')
+    assert not commands.has('cool', 'high', '18')
+    assert 'high' in commands['cool']
+    assert '18' not in commands['cool']['high']
+
+
+def test_irregular_tree(tmp_path):
+    """Trees without the regular shape are not indexed."""
+    path = tmp_path / 'device.json'
+    data = {'commands': {'cool': {'low': {'18': ['A', 'B']}}}}
+    path.write_text(json.dumps(data))
+
+    assert not sidecar.build(str(path), data)
+    assert not sidecar.is_fresh(str(path))
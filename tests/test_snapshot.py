@@ -0,0 +1,54 @@
+"""Tests of the snapshots of parsed device files."""
+import json
+from pathlib import Path
+import shutil
+
+from custom_components.smartir import lazy_json, snapshot
+
+CODES_DIR = Path(__file__).parent.parent / 'codes' / 'climate'
+
+
+def copy_device(tmp_path, device_code=1000):
+    """Copy a device file to tmp_path and return its path and json.load data."""
+    path = shutil.copy(CODES_DIR / f"{device_code}.json", tmp_path)
+    with open(path) as f:
+        return path, json.load(f)
+
+
+def test_round_trip(tmp_path):
+    """A snapshot reads back the device file as parsed by json.load."""
+    path, data = copy_device(tmp_path)
+    snapshot_path = str(tmp_path / 'snapshots' / 'climate_1000.snapshot')
+    digest = snapshot.file_digest(path)
+
+    snapshot.save(snapshot_path, digest, data)
+    loaded = snapshot.load(snapshot_path, digest)
+
+    assert dict(loaded, commands=dict(loaded['commands'])) == data
+
+
+def test_round_trip_lazy(tmp_path):
+    """Lazily loaded commands are saved as they are in the file."""
+    path, data = copy_device(tmp_path)
+    snapshot_path = str(tmp_path / 'climate_1000.snapshot')
+    digest = snapshot.file_digest(path)
+    lazy = lazy_json.load(path)
+
+    assert dict(lazy, commands=dict(lazy['commands'])) == data
+    snapshot.save(snapshot_path, digest, lazy_json.load(path))
+    loaded = snapshot.load(snapshot_path, digest)
+
+    assert dict(loaded, commands=dict(loaded['commands'])) == data
+
+
+def test_stale(tmp_path):
+    """A snapshot of other content, or an unreadable one, is ignored."""
+    path, data = copy_device(tmp_path)
+    snapshot_path = str(tmp_path / 'climate_1000.snapshot')
+
+    assert snapshot.load(snapshot_path, snapshot.file_digest(path)) is None
+    snapshot.save(snapshot_path, snapshot.file_digest(path), data)
+    assert snapshot.load(snapshot_path, 'other') is None
+
+    Path(snapshot_path).write_bytes(b'garbage')
+    assert snapshot.load(snapshot_path, snapshot.file_digest(path)) is None
@@ -0,0 +1,76 @@
+"""Tests of the press planner of stepped controls."""
+import pytest
+
+from custom_components.smartir.step_planner import DOWN, UP, StepPlanner, closest_index
+
+LEVELS = [0, 25, 50, 75, 100]
+
+
+def test_closest_index():
+    """Values snap to the closest level, ties to the higher one."""
+    assert closest_index(LEVELS, -10) == 0
+    assert closest_index(LEVELS, 30) == 1
+    assert closest_index(LEVELS, 12.5) == 1
+    assert closest_index(LEVELS, 1000) == 4
+
+
+def test_unknown_position_resyncs():
+    """An unknown position sweeps the whole range into the nearest end stop."""
+    planner = StepPlanner(LEVELS)
+
+    assert planner.uncertainty == 4
+    assert planner.plan(25) == [(DOWN, 4), (UP, 1)]
+    assert planner.value == 25
+    assert planner.uncertainty == pytest.approx(0.05)
+
+
+def test_known_position_moves_directly():
+    """A known position takes the fewest presses and gains uncertainty."""
+    planner = StepPlanner(LEVELS)
+    planner.restore(25)
+
+    assert planner.plan(75) == [(UP, 2)]
+    assert planner.plan(75) == []
+    assert planner.uncertainty == pytest.approx(0.1)
+
+
+def test_resync_at_threshold():
+    """Once the uncertainty reaches the threshold the move resyncs."""
+    planner = StepPlanner(LEVELS, press_uncertainty=0.5)
+    planner.restore(0)
+
+    assert planner.plan(50) == [(UP, 2)]
+    assert planner.uncertainty == 1
+    # Down past the bottom by the uncertainty, then back up.
+    assert planner.plan(25) == [(DOWN, 3), (UP, 1)]
+    assert planner.uncertainty == 0.5
+
+
+def test_free_resync_at_end_stop():
+    """Moving to an end stop while uncertain overshoots into it."""
+    planner = StepPlanner(LEVELS)
+    planner.restore(50)
+
+    assert planner.plan(75) == [(UP, 1)]
+    assert planner.plan(100) == [(UP, 2)]
+    assert planner.uncertainty == 0
+
+
+def test_forget():
+    """Restoring None forgets the position."""
+    planner = StepPlanner(LEVELS)
+    planner.restore(50)
+    planner.restore(None)
+
+    assert planner.value is None
+    assert planner.plan(100) == [(UP, 4)]
+
+
+def test_resync_uses_own_levels():
+    """Planners of different lengths resync over their own range."""
+    colortemps = StepPlanner([2700, 4000, 6500])
+    brightnesses = StepPlanner([10 * i for i in range(1, 11)])
+
+    assert colortemps.plan(6500) == [(UP, 2)]
+    assert brightnesses.plan(100) == [(UP, 9)]
+    assert brightnesses.plan(10) == [(DOWN, 9)]